@@ -1,30 +1,1126 @@
+import asyncio
+import atexit
 import hashlib
 import importlib
 import json
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+try:
+    import contextvars
+except ImportError:  # Python 3.6
+    contextvars = None
 
 from ansible.module_utils.basic import missing_required_lib
 from ansible.module_utils.parsing.convert_bool import boolean
 
 
+# vCenter drops the sessions that have been idle for 30 minutes, we evict
+# ours a bit before that.
+SESSION_MAX_IDLE = 25 * 60
+SESSION_POOL_MAX_SIZE = 32
+# The TLS connections are kept open between two module calls
+CONNECTOR_KEEPALIVE_TIMEOUT = 60
+# How long (in seconds) the index built by exists() is reused, the
+# changes done outside of the modules are not seen before that
+INDEX_TTL = 30
+# 7.0.2 and greater, then the older end-point
+SESSION_PATHS = ["/api/session", "/rest/com/vmware/cis/session"]
+# The answers of a vCenter that does not have the session end-point, the
+# other errors (e.g. 401) are not retried on the older end-point: each
+# attempt counts for the lockout of the account
+SESSION_PATH_MISSING_STATUSES = [400, 404, 405]
+# Number of log records written between two flushes and number of rotated
+# log files to keep
+LOG_BATCH_SIZE = 100
+LOG_BACKUP_COUNT = 3
+# How many times fetch_all() retries an item that failed with a
+# FetchError(retry=True), and the delay before the first retry (doubled
+# after each attempt). The connection errors and the RETRY_STATUSES are
+# already retried by the session.
+FETCH_RETRIES = 2
+FETCH_RETRY_DELAY = 0.5
+# The session retries the requests that vCenter sheds (see retry_delay()),
+# with an exponential backoff: RETRY_DELAY, then twice as long, etc. up to
+# RETRY_MAX_DELAY.
+RETRY_STATUSES = [429, 502, 503, 504]
+RETRY_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+# After CIRCUIT_BREAKER_THRESHOLD failures in a row, the requests to the
+# vCenter fail right away for CIRCUIT_BREAKER_COOLDOWN seconds
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN = 30
+# vCenter also uses 500 for some regular errors (e.g: DuplicateName), they
+# don't tell anything about its health.
+CIRCUIT_BREAKER_STATUSES = [502, 503, 504]
+# wait_for_task() polls the task after TASK_POLL_DELAY seconds, then less
+# and less often while the task does not progress, up to
+# TASK_POLL_MAX_DELAY.
+TASK_POLL_DELAY = 0.5
+TASK_POLL_MAX_DELAY = 10
+# wait_until() polls again after WAIT_POLL_DELAY seconds, then 50% later
+# after each attempt, up to WAIT_POLL_MAX_DELAY.
+WAIT_POLL_DELAY = 1
+WAIT_POLL_MAX_DELAY = 15
+# The lists where the order matters: the boot order and the priority of
+# the servers or of the firewall rules
+ORDERED_LISTS = ["devices", "rules", "servers"]
+# The keys that tell which variant of a structure is used, e.g. the type
+# of a disk backing, vCenter expects them with the rest of the structure
+DISCRIMINATOR_KEYS = ["type"]
+NUMBER_RE = re.compile(r"^-?[0-9]+(\.[0-9]+)?$")
+MAC_ADDRESS_RE = re.compile(r"^([0-9a-fA-F]{2}[:-]){5}[0-9a-fA-F]{2}$")
+# The filters of the list end-points that identify a resource, see
+# get_list_filters()
+IDENTITY_FILTERS = ["names", "folders"]
+# The identifiers in the URL paths: the managed objects (e.g. vm-1072,
+# domain-c8), the device keys (e.g. 2000), the UUIDs and the task IDs
+# (e.g. 52b1...:com.vmware.vcenter.vm, the colon may be quoted)
+RESOURCE_ID_RE = re.compile(
+    r"^(([a-z]+-)+[a-z]?[0-9]+|[0-9]+|"
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+    r"((:|%3[aA])[a-z][a-z0-9_.]*)?)$"
+)
+# The list end-points refuse the queries that match too many entries
+# (e.g. 4000 VM), the session splits them with these filters (see
+# list_partitioned()) and answers as if vCenter had accepted them. A
+# filter is only used if it never misses an entry: every VM runs on a
+# host, but not every host is in a cluster, and the folders filter does
+# not look in the subfolders.
+PARTITION_FILTERS = {
+    "vcenter/cluster": ["datacenters"],
+    "vcenter/datastore": ["datacenters"],
+    "vcenter/folder": ["datacenters"],
+    "vcenter/host": ["datacenters"],
+    "vcenter/network": ["datacenters"],
+    "vcenter/resource-pool": ["datacenters"],
+    "vcenter/vm": ["datacenters", "hosts"],
+}
+# The end-point that lists the values of each partition filter, and the
+# key of their ID
+PARTITION_SOURCES = {
+    "datacenters": ("vcenter/datacenter", "datacenter"),
+    "hosts": ("vcenter/host", "host"),
+}
+# The request headers we never write in the log file
+LOG_MASKED_HEADERS = ["authorization", "vmware-api-session-id"]
+# The read-mostly end-points whose answers can be cached (see
+# vcenter_rest_cache) and for how many seconds. A write request on one of
+# them drops the cached answers of the whole end-point.
+CACHE_TTLS = {
+    "vcenter/datacenter": 300,
+    "vcenter/folder": 60,
+    "vcenter/datastore": 60,
+    "vcenter/network": 300,
+    "vcenter/cluster": 300,
+    "vcenter/resource-pool": 60,
+}
+CACHE_MAX_SIZE = 1024
+
+
+class _RequestContextManager:
+    def __init__(self, coro):
+        self._coro = coro
+        self._resp = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        self._resp = await self._coro
+        return self._resp
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._resp.release()
+
+
+class BufferedResponse:
+    """A response whose body has already been read.
+
+    It can be kept after the connection has been released and shared
+    between several callers.
+    """
+
+    def __init__(self, method, url, status, headers, body):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._body = body
+
+    @classmethod
+    async def read_from(cls, resp):
+        try:
+            body = await resp.read()
+        finally:
+            resp.release()
+        return cls(resp.method, str(resp.url), resp.status, resp.headers, body)
+
+    async def read(self):
+        return self._body
+
+    async def text(self, encoding="utf-8"):
+        return self._body.decode(encoding)
+
+    async def json(self, **kwargs):
+        if not self._body.strip():
+            return None
+        return json.loads(self._body)
+
+    def release(self):
+        pass
+
+
+def get_cache_family(url):
+    """Return the CACHE_TTLS entry that url belongs to and its TTL."""
+    path = urlparse(url).path
+    for prefix in ["/api/", "/rest/"]:
+        if not path.startswith(prefix):
+            continue
+        path = path[len(prefix) :]
+        for family, ttl in CACHE_TTLS.items():
+            if path == family or path.startswith(family + "/"):
+                return family, ttl
+    return None, 0
+
+
+class ResponseCache:
+    """The cached GET answers, shared by all the sessions of the process.
+
+    The entries are keyed by (session digest, URL) and evicted when they
+    expire, or in LRU order once max_size is reached.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if not entry:
+            return
+        family, expire_at, resp = entry
+        if expire_at < time.monotonic():
+            del self._entries[key]
+            return
+        self._entries.move_to_end(key)
+        return resp
+
+    def set(self, key, family, ttl, resp):
+        self._entries[key] = (family, time.monotonic() + ttl, resp)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, family):
+        for key, entry in list(self._entries.items()):
+            if entry[0] == family:
+                del self._entries[key]
+
+
+response_cache = ResponseCache(CACHE_MAX_SIZE)
+
+
+class PooledSession:
+    """An authenticated vCenter session, as stored in the session pool.
+
+    It exposes the same get/post/patch/put/delete interface as
+    aiohttp.ClientSession. When vCenter answers with a 401, the session
+    authenticates again and replays the request once. The identical GET
+    requests sent at the same time share a single HTTP request and with
+    cache, the GET answers of the CACHE_TTLS end-points are served from
+    response_cache.
+    """
+
+    def __init__(
+        self,
+        aiohttp,
+        client_session,
+        vcenter_hostname,
+        auth,
+        concurrency,
+        digest=None,
+        cache=False,
+        retries=0,
+        rate_limiter=None,
+        timeouts=None,
+    ):
+        self.aiohttp = aiohttp
+        self.client_session = client_session
+        self.vcenter_hostname = vcenter_hostname
+        self.auth = auth
+        # Bounds the fan-out of requests (e.g: build_full_device_list), the
+        # semaphore is shared by all the sessions of the vCenter
+        self.concurrency = max(concurrency, 1)
+        self.semaphore = get_semaphore(vcenter_hostname, concurrency)
+        self.session_id = None
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.in_flight = 0
+        self._login_lock = asyncio.Lock()
+        # The indexes built by exists(), see invalidate_indexes()
+        self.indexes = get_device_indexes(vcenter_hostname, auth.login)
+        self.digest = digest
+        self.cache = cache
+        self.retries = max(retries, 0)
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = get_circuit_breaker(vcenter_hostname)
+        # The aiohttp.ClientTimeout of each operation class, see get_timeout()
+        self.timeouts = timeouts or {}
+        # The GET requests in progress, by URL
+        self.pending_gets = {}
+
+    @property
+    def age(self):
+        return time.monotonic() - self.created_at
+
+    @property
+    def idle_time(self):
+        if self.in_flight:
+            return 0
+        return time.monotonic() - self.last_used
+
+    async def login(self, expired_session_id=None):
+        async with self._login_lock:
+            if expired_session_id and self.session_id != expired_session_id:
+                # Another request has already renewed the session
+                return
+            self.session_id = await login(
+                self.aiohttp, self.client_session, self.vcenter_hostname, self.auth
+            )
+            self.created_at = time.monotonic()
+
+    async def close(self):
+        try:
+            if self.session_id:
+                path = login._session_path.get(self.vcenter_hostname, SESSION_PATHS[-1])
+                async with self.client_session.delete(
+                    f"https://{self.vcenter_hostname}{path}",
+                    headers={"vmware-api-session-id": self.session_id},
+                ):
+                    pass
+        except (self.aiohttp.ClientError, asyncio.TimeoutError):
+            # vCenter drops the idle sessions anyway
+            pass
+        finally:
+            await self.client_session.close()
+
+    def get_timeout(self, method, url):
+        """Return the timeout of a request, according to its class.
+
+        The actions that start a task (vmw-task=true) may take a while to
+        answer, the writes a bit less, the reads should be quick.
+        """
+        if "vmw-task=true" in url:
+            return self.timeouts.get("task")
+        if method == "GET":
+            return self.timeouts.get("read")
+        return self.timeouts.get("write")
+
+    async def _send(self, method, url, **kwargs):
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["vmware-api-session-id"] = self.session_id
+        timeout = self.get_timeout(method, url)
+        if timeout:
+            kwargs.setdefault("timeout", timeout)
+        return await self.client_session.request(method, url, headers=headers, **kwargs)
+
+    def can_retry_error(self, method, error):
+        """Tell if the request can be sent again after error.
+
+        The GET requests are retried after any connection error or timeout.
+        The other methods only when the connection could not be established:
+        a request dropped by the server may already have been applied and we
+        don't want to apply a change twice.
+        """
+        if method == "GET":
+            return isinstance(
+                error, (self.aiohttp.ClientConnectionError, asyncio.TimeoutError)
+            )
+        return isinstance(error, self.aiohttp.ClientConnectorError)
+
+    def can_retry_status(self, method, status):
+        """Tell if the request can be sent again after an HTTP error.
+
+        vCenter has not processed a request rejected with a 429, the other
+        RETRY_STATUSES are only safe to retry with a GET.
+        """
+        if method == "GET":
+            return status in RETRY_STATUSES
+        return status == 429
+
+    async def _send_with_retries(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            self.circuit_breaker.check()
+            if self.rate_limiter:
+                waited = await self.rate_limiter.acquire()
+                # Recorded by metrics_trace_config()
+                kwargs["trace_request_ctx"] = {"queue": waited}
+            try:
+                resp = await self._send(method, url, **kwargs)
+            except (self.aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # A bare TimeoutError is the total timeout, it also counts the
+                # wait for a free connection of the pool: it's not a vCenter
+                # failure. The socket timeouts are ServerTimeoutError.
+                if isinstance(e, self.aiohttp.ClientConnectionError):
+                    self.circuit_breaker.record_failure()
+                if attempt >= self.retries or not self.can_retry_error(method, e):
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+            else:
+                if resp.status in CIRCUIT_BREAKER_STATUSES:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                if attempt >= self.retries or not self.can_retry_status(
+                    method, resp.status
+                ):
+                    return resp
+                resp.release()
+                await asyncio.sleep(
+                    retry_delay(attempt, resp.headers.get("Retry-After"))
+                )
+            attempt += 1
+
+    def invalidate_indexes(self, url):
+        """Drop the indexes of the resources that url may have changed."""
+        url = url.split("?")[0]
+        for key in list(self.indexes):
+            if url.startswith(key[0]) or key[0].startswith(url):
+                del self.indexes[key]
+
+    async def _request(self, method, url, **kwargs):
+        if method != "GET" or kwargs:
+            return await self._send_request(method, url, **kwargs)
+
+        resp = await self._cached_get(url)
+        if resp.status == 400:
+            resp = await self._split_refused_list(resp)
+        return resp
+
+    async def _cached_get(self, url):
+        family, ttl = get_cache_family(url) if self.cache else (None, 0)
+        if ttl:
+            resp = response_cache.get((self.digest, url))
+            if resp:
+                self.last_used = time.monotonic()
+                return resp
+        resp = await self._coalesced_get(url)
+        if ttl and resp.status == 200:
+            response_cache.set((self.digest, url), family, ttl, resp)
+        return resp
+
+    async def _coalesced_get(self, url):
+        if url not in self.pending_gets:
+
+            async def buffered_get():
+                return await BufferedResponse.read_from(
+                    await self._send_request("GET", url)
+                )
+
+            task = asyncio.ensure_future(buffered_get())
+            task.add_done_callback(lambda t: self.pending_gets.pop(url, None))
+            self.pending_gets[url] = task
+        # The request goes on if one of the callers is cancelled
+        return await asyncio.shield(self.pending_gets[url])
+
+    async def _split_refused_list(self, resp):
+        """List again, with list_partitioned(), what vCenter has refused.
+
+        The answer of the partitions is returned as if vCenter had accepted
+        the query, so the callers don't have to care about the size of the
+        inventory.
+        """
+        path = urlparse(resp.url).path
+        endpoint = path.split("/", 2)[2] if path.count("/") > 1 else ""
+        if endpoint not in PARTITION_FILTERS:
+            return resp
+        try:
+            answer = await resp.json()
+        except ValueError:
+            return resp
+        if not is_too_many_results(answer):
+            return resp
+        # e.g: vcenter/resource-pool -> resource_pool
+        id_key = endpoint.split("/")[-1].replace("-", "_")
+        _json, status = await list_partitioned(
+            self, resp.url, id_key, answer=(answer, resp.status)
+        )
+        if path.startswith("/api/"):  # 7.0.2+
+            _json = _json["value"]
+        return BufferedResponse(
+            resp.method, resp.url, status, resp.headers, json.dumps(_json).encode(),
+        )
+
+    async def _send_request(self, method, url, **kwargs):
+        self.in_flight += 1
+        try:
+            session_id = self.session_id
+            resp = await self._send_with_retries(method, url, **kwargs)
+            if resp.status == 401:
+                resp.release()
+                await self.login(expired_session_id=session_id)
+                resp = await self._send_with_retries(method, url, **kwargs)
+            return resp
+        finally:
+            if method != "GET":
+                self.invalidate_indexes(url)
+                family, _ = get_cache_family(url)
+                if family:
+                    response_cache.invalidate(family)
+            self.in_flight -= 1
+            self.last_used = time.monotonic()
+
+    def request(self, method, url, **kwargs):
+        return _RequestContextManager(self._request(method, url, **kwargs))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+
+def retry_delay(attempt, retry_after=None):
+    """Return how long to wait before the next attempt.
+
+    The Retry-After header of the answer wins, it can be a number of
+    seconds or a date. Otherwise the backoff is exponential with a random
+    jitter, so the clients of a busy vCenter don't come back all at once.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), RETRY_MAX_DELAY)
+    delay = min(RETRY_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def login(aiohttp, client_session, vcenter_hostname, auth):
+    """Authenticate and return a new session ID.
+
+    The request goes through the pooled ClientSession, so it reuses the
+    connection already open with the vCenter.
+    """
+    exceptions = importlib.import_module(
+        "ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions"
+    )
+    if vcenter_hostname in login._session_path:
+        paths = [login._session_path[vcenter_hostname]]
+    else:
+        paths = SESSION_PATHS
+    circuit_breaker = get_circuit_breaker(vcenter_hostname)
+    error = "no session end-point found"
+    for path in paths:
+        circuit_breaker.check()
+        try:
+            async with client_session.post(
+                f"https://{vcenter_hostname}{path}", auth=auth
+            ) as resp:
+                if resp.status in CIRCUIT_BREAKER_STATUSES:
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.record_success()
+                if resp.status not in [200, 201]:
+                    error = "code: {0}, json: {1}".format(
+                        resp.status, await resp.text()
+                    )
+                    # e.g: /api/session does not exist before 7.0.2
+                    if resp.status in SESSION_PATH_MISSING_STATUSES:
+                        continue
+                    break
+                json = await resp.json()
+        except asyncio.TimeoutError as e:
+            # Only the socket timeouts, see PooledSession._send_with_retries()
+            if isinstance(e, aiohttp.ClientConnectionError):
+                circuit_breaker.record_failure()
+            raise exceptions.EmbeddedModuleFailure(
+                f"Authentication failure: timeout while connecting to {vcenter_hostname}"
+            )
+        except aiohttp.ClientError as e:
+            # e.g: connection refused or closed by the server
+            circuit_breaker.record_failure()
+            raise exceptions.EmbeddedModuleFailure(
+                f"Authentication failure: {str(e) or repr(e)}"
+            )
+        login._session_path[vcenter_hostname] = path
+        if isinstance(json, dict):  # < 7.0.2
+            return json["value"]
+        return json
+    raise exceptions.EmbeddedModuleFailure(f"Authentication failure. {error}")
+
+
+login._session_path = {}
+
+
+def get_connector(aiohttp, vcenter_hostname, validate_certs, limit=20):
+    """Return the TCPConnector shared by all the sessions of a vCenter.
+
+    The connector only opens connections to vcenter_hostname, limit is
+    already the limit per host and we don't set limit_per_host.
+    """
+    key = (vcenter_hostname, validate_certs, limit)
+    connector = get_connector._connectors.get(key)
+    if connector and not connector.closed:
+        return connector
+    if validate_certs:
+        connector = aiohttp.TCPConnector(
+            limit=limit, keepalive_timeout=CONNECTOR_KEEPALIVE_TIMEOUT
+        )
+    else:
+        connector = aiohttp.TCPConnector(
+            limit=limit, keepalive_timeout=CONNECTOR_KEEPALIVE_TIMEOUT, ssl=False
+        )
+    get_connector._connectors[key] = connector
+    return connector
+
+
+get_connector._connectors = {}
+
+
+def get_semaphore(vcenter_hostname, concurrency):
+    """Return the concurrency budget of a vCenter."""
+    key = (vcenter_hostname, concurrency)
+    if key not in get_semaphore._semaphores:
+        get_semaphore._semaphores[key] = asyncio.Semaphore(max(concurrency, 1))
+    return get_semaphore._semaphores[key]
+
+
+get_semaphore._semaphores = {}
+
+
+def get_device_indexes(vcenter_hostname, username):
+    """Return the indexes built by exists() for a vCenter user.
+
+    The sessions of the same user see the same resources, they share their
+    indexes whatever their other settings.
+    """
+    key = (vcenter_hostname, username)
+    return get_device_indexes._indexes.setdefault(key, {})
+
+
+get_device_indexes._indexes = {}
+
+
+class RateLimiter:
+    """A token bucket, rate requests per second and up to burst at once.
+
+    The requests get their token in the order they have asked for it.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for a token, return how long it took."""
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        return time.monotonic() - start
+
+
+class CircuitBreaker:
+    """Stop sending requests to a vCenter that keeps failing.
+
+    The breaker opens after threshold consecutive failures (connection
+    errors, socket timeouts or CIRCUIT_BREAKER_STATUSES). Once cooldown seconds
+    have passed, a single request is let through (half-open). If it
+    succeeds the breaker closes, otherwise it opens again.
+    """
+
+    def __init__(self, vcenter_hostname, threshold, cooldown):
+        self.vcenter_hostname = vcenter_hostname
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    def check(self, trial=True):
+        """Raise EmbeddedModuleFailure if the request must not be sent.
+
+        With trial=False, the caller is not about to send a request and
+        does not take the place of the half-open trial.
+        """
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        retry_in = self.opened_at + self.cooldown - now
+        if retry_in <= 0 and not trial:
+            return
+        if retry_in <= 0 and (
+            self.trial_started_at is None or now - self.trial_started_at > self.cooldown
+        ):
+            self.trial_started_at = now
+            return
+        exceptions = importlib.import_module(
+            "ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions"
+        )
+        raise exceptions.EmbeddedModuleFailure(
+            f"vCenter {self.vcenter_hostname} is unavailable: {self.failures} "
+            f"consecutive request failures, next attempt in {max(retry_in, 0):.0f}s"
+        )
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_started_at = None
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+def get_circuit_breaker(vcenter_hostname):
+    if vcenter_hostname not in get_circuit_breaker._breakers:
+        get_circuit_breaker._breakers[vcenter_hostname] = CircuitBreaker(
+            vcenter_hostname, CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN
+        )
+    return get_circuit_breaker._breakers[vcenter_hostname]
+
+
+get_circuit_breaker._breakers = {}
+
+
+def get_rate_limiter(vcenter_hostname, rate, burst):
+    """Return the rate limiter of a vCenter, None if rate is not set."""
+    if not rate or rate <= 0:
+        return
+    key = (vcenter_hostname, rate, burst)
+    if key not in get_rate_limiter._limiters:
+        get_rate_limiter._limiters[key] = RateLimiter(rate, burst)
+    return get_rate_limiter._limiters[key]
+
+
+get_rate_limiter._limiters = {}
+
+
+class AdaptiveConcurrency:
+    """A concurrency limit that follows the latency of the vCenter.
+
+    The limit starts at initial and grows by one each time a request
+    completes in less than tolerance times the lowest latency seen so far.
+    When a request is slower, or when the vCenter is overloaded (e.g. 429
+    or 503), the limit is halved, like the TCP congestion control. Only
+    the requests sent after the last decrease can decrease it again, the
+    requests already in flight were sent with the former limit.
+    """
+
+    def __init__(self, maximum, initial=2, tolerance=2):
+        self.maximum = max(maximum, 1)
+        self.limit = min(initial, self.maximum)
+        self.tolerance = tolerance
+        self.min_latency = None
+        self.in_flight = 0
+        self.generation = 0
+        self.highest = self.limit
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait for a slot, return the token to pass to release()."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            return self.generation
+
+    async def release(self, token, latency=None, overloaded=False):
+        async with self._condition:
+            self.in_flight -= 1
+            if latency is not None and not overloaded:
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                overloaded = latency > self.min_latency * self.tolerance
+            if overloaded and token == self.generation:
+                self.limit = max(self.limit // 2, 1)
+                self.generation += 1
+            elif not overloaded and latency is not None:
+                self.limit = min(self.limit + 1, self.maximum)
+                self.highest = max(self.highest, self.limit)
+            self._condition.notify_all()
+
+
+def get_durations_summary(durations):
+    """Return the min, average, median, 95th percentile and max of durations."""
+    if not durations:
+        return {}
+    durations = sorted(durations)
+    return {
+        "min": round(durations[0], 3),
+        "avg": round(sum(durations) / len(durations), 3),
+        "p50": round(durations[len(durations) // 2], 3),
+        "p95": round(durations[min(int(len(durations) * 0.95), len(durations) - 1)], 3),
+        "max": round(durations[-1], 3),
+    }
+
+
+class RequestLogWriter:
+    """Write the HTTP requests in a log file, one JSON document per line.
+
+    The trace hooks only queue the records, a background task writes them
+    by batch through a single file handle. The file is rotated when it
+    reaches max_file_size (in bytes, 0 to disable the rotation).
+    """
+
+    def __init__(self, path, max_file_size=0):
+        self.path = path
+        self.max_file_size = max_file_size
+        self.queue = asyncio.Queue()
+        self._fd = None
+        self._task = None
+        atexit.register(self.close)
+
+    def write(self, record):
+        self.queue.put_nowait(record)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._consume())
+
+    async def _consume(self):
+        while not self.queue.empty():
+            records = []
+            while not self.queue.empty() and len(records) < LOG_BATCH_SIZE:
+                records.append(self.queue.get_nowait())
+            self._write_batch(records)
+            # Give the hand back to the requests
+            await asyncio.sleep(0)
+
+    def _write_batch(self, records):
+        data = "".join(json.dumps(r, default=str) + "\n" for r in records)
+        if self._fd is None:
+            self._fd = open(self.path, "a")
+        if self.max_file_size and self._fd.tell() + len(data) > self.max_file_size:
+            self._rotate()
+        self._fd.write(data)
+        self._fd.flush()
+
+    def _rotate(self):
+        self._fd.close()
+        for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._fd = open(self.path, "a")
+
+    def close(self):
+        """Flush what is still in the queue, e.g: when the module exits."""
+        records = []
+        while not self.queue.empty():
+            records.append(self.queue.get_nowait())
+        if records:
+            self._write_batch(records)
+        if self._fd:
+            self._fd.close()
+            self._fd = None
+
+
+def get_log_writer(path, max_file_size=0):
+    key = (path, max_file_size)
+    if key not in get_log_writer._writers:
+        get_log_writer._writers[key] = RequestLogWriter(path, max_file_size)
+    return get_log_writer._writers[key]
+
+
+get_log_writer._writers = {}
+
+
+def log_trace_config(aiohttp, log_writer, max_body_size=-1):
+    """Return a TraceConfig that records the requests through log_writer.
+
+    max_body_size is the number of bytes of the answers to record, 0 to skip
+    them and -1 to keep them in full.
+    """
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_end(session, trace_config_ctx, params):
+        record = {
+            "time": time.time(),
+            "method": params.method,
+            "url": str(params.url),
+            "headers": {
+                k: ("******" if k.lower() in LOG_MASKED_HEADERS else v)
+                for k, v in params.headers.items()
+            },
+            "status": params.response.status,
+        }
+        if max_body_size:
+            # The body is cached by aiohttp, the module will not read it again
+            answer = await params.response.read()
+            if max_body_size > 0 and len(answer) > max_body_size:
+                record["truncated"] = True
+                answer = answer[:max_body_size]
+            record["answer"] = answer.decode("utf-8", errors="replace")
+        log_writer.write(record)
+
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+# The RequestMetrics of the running module, if the module has asked for them
+if contextvars:
+    request_metrics = contextvars.ContextVar("request_metrics", default=None)
+else:
+    request_metrics = None
+
+
+def get_request_metrics():
+    if request_metrics:
+        return request_metrics.get()
+
+
+def get_endpoint_template(path, query=None):
+    """Turn a URL path into its end-point template.
+
+    e.g: /api/vcenter/vm/vm-1072/hardware/disk/2000 becomes
+    /api/vcenter/vm/{vm}/hardware/disk/{disk}
+
+    Only the segments that follow a collection name and look like an
+    identifier are replaced, /api/appliance/networking/interfaces/nic0/ipv4
+    and .../ipv6 remain two different end-points.
+    """
+    template = []
+    for i in path.split("/"):
+        # e.g: "", "api", "vcenter"
+        after_collection = len(template) > 2 and not template[-1].startswith("{")
+        if after_collection and RESOURCE_ID_RE.match(i):
+            template.append("{" + template[-1] + "}")
+        else:
+            template.append(i)
+    template = "/".join(template)
+    if query and "action" in query:
+        template += "?action=" + query["action"]
+    return template
+
+
+class RequestMetrics:
+    """The timings of the HTTP requests, grouped by end-point template.
+
+    All the durations are in seconds. queue is the time spent waiting for
+    the rate limiter. connect covers both the TCP connection and the TLS
+    handshake, aiohttp does not trace them separately.
+    """
+
+    PHASES = ["queue", "dns", "connect", "ttfb", "total"]
+
+    def __init__(self):
+        self.endpoints = {}
+
+    def record(self, method, url):
+        key = method + " " + get_endpoint_template(url.path, url.query)
+        timings = {"error": False}
+        self.endpoints.setdefault(key, []).append(timings)
+        return timings
+
+    def to_dict(self):
+        result = {}
+        for key, requests in self.endpoints.items():
+            result[key] = {
+                "count": len(requests),
+                "errors": len([r for r in requests if r["error"]]),
+            }
+            for phase in self.PHASES:
+                values = [r[phase] for r in requests if phase in r]
+                if values:
+                    result[key][phase] = {
+                        "sum": round(sum(values), 6),
+                        "max": round(max(values), 6),
+                    }
+        return result
+
+
+def metrics_trace_config(aiohttp):
+    """Return a TraceConfig that feeds the RequestMetrics of the module."""
+    trace_config = aiohttp.TraceConfig()
+
+    def _now():
+        return asyncio.get_event_loop().time()
+
+    async def on_request_start(session, ctx, params):
+        metrics = get_request_metrics()
+        ctx.timings = metrics.record(params.method, params.url) if metrics else None
+        ctx.start = _now()
+        if ctx.timings is not None and ctx.trace_request_ctx:
+            ctx.timings["queue"] = ctx.trace_request_ctx["queue"]
+
+    async def on_dns_resolvehost_start(session, ctx, params):
+        ctx.dns_start = _now()
+
+    async def on_dns_resolvehost_end(session, ctx, params):
+        if ctx.timings is not None:
+            ctx.timings["dns"] = _now() - ctx.dns_start
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_start = _now()
+
+    async def on_connection_create_end(session, ctx, params):
+        if ctx.timings is not None:
+            ctx.timings["connect"] = _now() - ctx.connect_start
+
+    async def on_request_end(session, ctx, params):
+        if ctx.timings is not None:
+            ctx.timings["ttfb"] = ctx.timings["total"] = _now() - ctx.start
+
+    async def on_response_chunk_received(session, ctx, params):
+        if ctx.timings is not None:
+            ctx.timings["total"] = _now() - ctx.start
+
+    async def on_request_exception(session, ctx, params):
+        if ctx.timings is not None:
+            ctx.timings["error"] = True
+            ctx.timings["total"] = _now() - ctx.start
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def evict_sessions(pool, max_idle=SESSION_MAX_IDLE, max_size=SESSION_POOL_MAX_SIZE):
+    """Close the idle sessions and keep the pool below max_size.
+
+    The evicted sessions are closed in the background, a vCenter that does
+    not answer must not block the modules that target another one.
+    """
+    for digest, session in list(pool.items()):
+        if session.idle_time > max_idle:
+            del pool[digest]
+            close_in_background(session)
+
+    # Least recently used first, but leave the sessions in use alone
+    candidates = sorted(
+        (i for i in pool.items() if not i[1].in_flight), key=lambda i: i[1].last_used
+    )
+    while len(pool) >= max_size and candidates:
+        digest, session = candidates.pop(0)
+        del pool[digest]
+        close_in_background(session)
+
+
+def close_in_background(session):
+    task = asyncio.ensure_future(session.close())
+    # Keep a reference until the end of the task
+    close_in_background._tasks.add(task)
+
+    def _done(task):
+        close_in_background._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()  # Retrieved, the session is gone anyway
+
+    task.add_done_callback(_done)
+
+
+close_in_background._tasks = set()
+
+
+def build_timeouts(aiohttp, connect_timeout, read_timeout, write_timeout, task_timeout):
+    """Return the aiohttp.ClientTimeout of each class of request.
+
+    0 means no timeout. The connect timeout is a sock_connect one: the
+    requests that wait for a free connection of the pool (when the
+    concurrency is above the connection limit) don't time out on it.
+    """
+    return {
+        name: aiohttp.ClientTimeout(
+            total=total or None, sock_connect=connect_timeout or None
+        )
+        for name, total in [
+            ("read", read_timeout),
+            ("write", write_timeout),
+            ("task", task_timeout),
+        ]
+    }
+
+
 async def open_session(
     vcenter_hostname=None,
     vcenter_username=None,
     vcenter_password=None,
     validate_certs=True,
     log_file=None,
+    connection_limit=20,
+    concurrency=20,
+    log_max_body_size=-1,
+    log_max_file_size=0,
+    collect_metrics=False,
+    cache=False,
+    retries=3,
+    rate_limit=0,
+    rate_burst=10,
+    connect_timeout=30,
+    read_timeout=60,
+    write_timeout=300,
+    task_timeout=3600,
 ):
     validate_certs = boolean(validate_certs)
+    cache = boolean(cache)
     m = hashlib.sha256()
     m.update(vcenter_hostname.encode())
     m.update(vcenter_username.encode())
     m.update(vcenter_password.encode())
     if log_file:
-        m.update(log_file.encode())
+        m.update(f"{log_file}/{log_max_body_size}/{log_max_file_size}".encode())
     m.update(b"yes" if validate_certs else b"no")
+    m.update(f"{connection_limit}/{concurrency}/{retries}".encode())
+    if cache:
+        m.update(b"cache")
+    # The sessions opened without collect_metrics don't trace the requests
+    if boolean(collect_metrics):
+        m.update(b"metrics")
+    if rate_limit:
+        m.update(f"{rate_limit}/{rate_burst}".encode())
+    m.update(
+        f"{connect_timeout}/{read_timeout}/{write_timeout}/{task_timeout}".encode()
+    )
     digest = m.hexdigest()
-    # TODO: Handle session timeout
+    # Fail fast if the vCenter is known to be down
+    get_circuit_breaker(vcenter_hostname).check(trial=False)
+    # Only the requests of the current module are recorded
+    if request_metrics:
+        request_metrics.set(RequestMetrics() if boolean(collect_metrics) else None)
+    evict_sessions(open_session._pool)
     if digest in open_session._pool:
-        return open_session._pool[digest]
+        session = open_session._pool[digest]
+        session.last_used = time.monotonic()
+        return session
 
     exceptions = importlib.import_module(
         "ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions"
@@ -37,59 +1133,48 @@ async def open_session(
     if not aiohttp:
         raise exceptions.EmbeddedModuleFailure(msg="Failed to import aiohttp")
 
+    trace_configs = []
+    if boolean(collect_metrics):
+        trace_configs.append(metrics_trace_config(aiohttp))
     if log_file:
-        trace_config = aiohttp.TraceConfig()
-
-        async def on_request_end(session, trace_config_ctx, params):
-            with open(log_file, "a+") as fd:
-                answer = await params.response.text()
-                fd.write(
-                    f"{params.method}: {params.url}\n"
-                    f"headers: {params.headers}\n"
-                    f"  status: {params.response.status}\n"
-                    f"  answer: {answer}\n\n"
-                )
-
-        trace_config.on_request_end.append(on_request_end)
-        trace_configs = [trace_config]
-    else:
-        trace_configs = []
+        log_writer = get_log_writer(log_file, log_max_file_size * 1024 * 1024)
+        trace_configs.append(log_trace_config(aiohttp, log_writer, log_max_body_size))
 
+    timeouts = build_timeouts(
+        aiohttp, connect_timeout, read_timeout, write_timeout, task_timeout
+    )
     auth = aiohttp.BasicAuth(vcenter_username, vcenter_password)
-    if validate_certs:
-        connector = aiohttp.TCPConnector(limit=20)
-    else:
-        connector = aiohttp.TCPConnector(limit=20, ssl=False)
-    async with aiohttp.ClientSession(
-        connector=connector, connector_owner=False, trace_configs=trace_configs
-    ) as session:
-        try:
-            async with session.post(
-                "https://{hostname}/rest/com/vmware/cis/session".format(
-                    hostname=vcenter_hostname
-                ),
-                auth=auth,
-            ) as resp:
-                if resp.status != 200:
-                    raise exceptions.EmbeddedModuleFailure(
-                        "Authentication failure. code: {0}, json: {1}".format(
-                            resp.status, await resp.text()
-                        )
-                    )
-                json = await resp.json()
-        except aiohttp.client_exceptions.ClientConnectorError as e:
-            raise exceptions.EmbeddedModuleFailure(f"Authentication failure: {e}")
-
-    session_id = json["value"]
-    session = aiohttp.ClientSession(
+    connector = get_connector(
+        aiohttp, vcenter_hostname, validate_certs, limit=connection_limit
+    )
+    client_session = aiohttp.ClientSession(
         connector=connector,
-        headers={
-            "vmware-api-session-id": session_id,
-            "content-type": "application/json",
-        },
         connector_owner=False,
+        headers={"content-type": "application/json"},
         trace_configs=trace_configs,
+        timeout=timeouts["write"],
     )
+    session = PooledSession(
+        aiohttp,
+        client_session,
+        vcenter_hostname,
+        auth,
+        concurrency,
+        digest=digest,
+        cache=cache,
+        retries=retries,
+        rate_limiter=get_rate_limiter(vcenter_hostname, rate_limit, rate_burst),
+        timeouts=timeouts,
+    )
+    try:
+        await session.login()
+    except Exception:
+        await client_session.close()
+        raise
+    # Another module may have opened the same session in the meantime
+    if digest in open_session._pool:
+        await session.close()
+        return open_session._pool[digest]
     open_session._pool[digest] = session
     return session
 
@@ -204,9 +1289,105 @@ async def update_changed_flag(data, status, operation):
         data["failed"] = True
 
     data["_debug_info"] = {"status": status, "operation": operation}
+    metrics = get_request_metrics()
+    if metrics:
+        data["_debug_info"]["requests"] = metrics.to_dict()
     return data
 
 
+async def get_task(session, vcenter_hostname, task_id):
+    url = f"https://{vcenter_hostname}/api/cis/tasks/{task_id}"
+    async with session.get(url) as resp:
+        _json = await resp.json()
+        if resp.status != 200:
+            raise FetchError(f"{url}: status {resp.status}, json: {_json}")
+        return _json
+
+
+async def wait_for_task(session, vcenter_hostname, data):
+    """Wait for the task started by a vmw-task=true action.
+
+    data is the answer of the module, its value is the task ID. The task is
+    polled until it succeeds or fails, for at most the task timeout of the
+    session. The returned answer comes with the value of the task result
+    and the last state of the task in "task", with the successive progress
+    steps.
+    """
+    task_id = data["value"]
+    timeout = session.timeouts.get("task")
+    deadline = time.monotonic() + timeout.total if timeout and timeout.total else None
+    delay = TASK_POLL_DELAY
+    progress = []
+    while True:
+        try:
+            task = await get_task(session, vcenter_hostname, task_id)
+        except FetchError as e:
+            return {"value": task_id, "failed": True, "msg": str(e)}
+        if task.get("progress") and task["progress"] not in progress:
+            progress.append(task["progress"])
+            delay = TASK_POLL_DELAY
+        else:
+            delay = min(delay * 1.5, TASK_POLL_MAX_DELAY)
+        if task.get("status") in ["SUCCEEDED", "FAILED"]:
+            break
+        if deadline and time.monotonic() + delay > deadline:
+            return {
+                "value": task_id,
+                "failed": True,
+                "msg": f"Task {task_id} is still {task.get('status')} after {timeout.total}s",
+                "task": dict(task, id=task_id, progress=progress),
+            }
+        await asyncio.sleep(delay)
+
+    data = dict(data, task=dict(task, id=task_id, progress=progress))
+    if task["status"] == "FAILED":
+        data["value"] = task.get("error")
+        data["failed"] = True
+        data["changed"] = False
+        data["msg"] = f"Task {task_id} has failed"
+    else:
+        data["value"] = task.get("result")
+        data["failed"] = False
+        data["changed"] = True
+    return data
+
+
+async def wait_until(func, condition=None, timeout=300):
+    """Call func() until the JMESPath condition is true on its value.
+
+    func returns the answer of the module, e.g: entry_point(). An answer
+    that has failed does not match the condition, the resource may not be
+    ready yet. Without condition, func() is called once.
+    """
+    if not condition:
+        return await func()
+    try:
+        jmespath = importlib.import_module("jmespath")
+    except ImportError:
+        return {"failed": True, "msg": missing_required_lib("jmespath")}
+    try:
+        expression = jmespath.compile(condition)
+    except jmespath.exceptions.ParseError as e:
+        return {"failed": True, "msg": f"Invalid wait_for condition: {e}"}
+
+    deadline = time.monotonic() + timeout
+    delay = WAIT_POLL_DELAY
+    attempts = 0
+    while True:
+        result = await func()
+        attempts += 1
+        if not result.get("failed") and expression.search(result.get("value")):
+            break
+        if time.monotonic() + delay > deadline:
+            result["failed"] = True
+            result["msg"] = f"The condition {condition} is still false after {timeout}s"
+            break
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, WAIT_POLL_MAX_DELAY)
+    result.setdefault("_debug_info", {})["wait_for"] = {"attempts": attempts}
+    return result
+
+
 async def list_devices(session, url):
     existing_entries = []
 
@@ -215,9 +1396,204 @@ async def list_devices(session, url):
         return _json
 
 
-async def build_full_device_list(session, url, device_list):
-    import asyncio
+def is_too_many_results(_json):
+    """Tell if a list end-point has refused a query that matches too many entries."""
+    if not isinstance(_json, dict):
+        return False
+    error_type = _json.get("error_type") or _json.get("type")  # 7.0.2 <
+    if not error_type and isinstance(_json.get("value"), dict):
+        error_type = _json["value"].get("error_type")
+    return str(error_type or "").lower().endswith("unable_to_allocate_resource")
+
+
+async def list_partitioned(session, url, id_key, answer=None):
+    """List url, split the query as long as vCenter refuses it.
+
+    The query is split with the PARTITION_FILTERS of the end-point, e.g. by
+    datacenter, then by host, and the partitions are listed in parallel, at
+    most session.concurrency at a time. The entries that come several times
+    are only kept once. answer is the (json, status) of url if the caller
+    has already listed it.
+
+    Return the answer, with the entries under "value", and its status.
+    """
+    parsed = urlparse(url)
+    # e.g: https://vcenter/api/ and vcenter/vm
+    endpoint = parsed.path.split("/", 2)[2]
+    base_url = url.split("?")[0][: -len(endpoint)]
+    # Not the semaphore of the vCenter, the caller may already hold it
+    semaphore = asyncio.Semaphore(session.concurrency)
+
+    async def _list(endpoint, filters, id_key, answer=None):
+        if answer:
+            _json, status = answer
+        else:
+            query = "?" + urlencode(filters) if filters else ""
+            async with semaphore:
+                resp = await session._cached_get(base_url + endpoint + query)
+                _json = await resp.json()
+                status = resp.status
+        if not is_too_many_results(_json):
+            return _json, status
+        names = [k for k, v in filters]
+        candidates = [
+            i for i in PARTITION_FILTERS.get(endpoint, []) if names.count(i) != 1
+        ]
+        if not candidates:
+            return _json, status
+        name = candidates[0]
+        values = [v for k, v in filters if k == name]
+        if not values:
+            source, source_key = PARTITION_SOURCES[name]
+            source_filters = [
+                (k, v) for k, v in filters if k in PARTITION_FILTERS.get(source, [])
+            ]
+            source_json, source_status = await _list(source, source_filters, source_key)
+            if source_status != 200:
+                return source_json, source_status
+            if isinstance(source_json, dict):  # 7.0.2 <
+                source_json = source_json["value"]
+            values = [i[source_key] for i in source_json]
+
+        others = [(k, v) for k, v in filters if k != name]
+        answers = await asyncio.gather(
+            *[_list(endpoint, others + [(name, v)], id_key) for v in values]
+        )
+        entries = OrderedDict()
+        for _json, status in answers:
+            if status != 200:
+                return _json, status
+            if isinstance(_json, dict):  # 7.0.2 <
+                _json = _json["value"]
+            for entry in _json:
+                entries.setdefault(entry[id_key], entry)
+        return list(entries.values()), 200
+
+    _json, status = await _list(endpoint, parse_qsl(parsed.query), id_key, answer)
+    if not isinstance(_json, dict) or "value" not in _json:
+        _json = {"value": _json}
+    return _json, status
+
 
+class FetchError(Exception):
+    def __init__(self, msg, retry=False):
+        super().__init__(msg)
+        self.retry = retry
+
+
+async def fetch_all(session, func, items, failures=None, retries=FETCH_RETRIES):
+    """Call func(item) for each item, with a bounded concurrency.
+
+    A pool of workers (at most session.concurrency) consumes the items, the
+    requests also go through the concurrency budget of the vCenter. An
+    item is retried (FETCH_RETRIES times by default) when func raises a
+    FetchError with retry=True. The connection errors are not retried here,
+    the session has already retried the request.
+
+    The results keep the order of the items. When an item still fails, its
+    result is None and, if failures is a list, {"item": ..., "error": ...} is
+    appended to it.
+    """
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+
+    async def _worker():
+        for index, item in pending:
+            error = None
+            for attempt in range(retries + 1):
+                if attempt:
+                    await asyncio.sleep(FETCH_RETRY_DELAY * 2 ** (attempt - 1))
+                try:
+                    async with session.semaphore:
+                        results[index] = await func(item)
+                    error = None
+                    break
+                except FetchError as e:
+                    error = e
+                    if not e.retry:
+                        break
+                except (session.aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                    break
+            if error and failures is not None:
+                failures.append({"item": item, "error": str(error)})
+
+    workers = min(session.concurrency, len(items))
+    await asyncio.gather(*[_worker() for i in range(workers)])
+    return results
+
+
+async def list_ids(session, url, filters, id_key):
+    """Return the IDs of the resources that match the filters.
+
+    filters maps the query parameters of the list end-point (e.g: names,
+    folders) on their list of values.
+    """
+    query = [(k, v) for k, values in filters.items() for v in values or []]
+    if query:
+        url += "?" + urlencode(query)
+    _json = await list_devices(session, url)
+    if isinstance(_json, dict):  # 7.0.2 <
+        _json = _json.get("value")
+    if not isinstance(_json, list):
+        raise FetchError(f"{url}: unexpected answer: {_json}")
+    return [i[id_key] for i in _json]
+
+
+async def run_for_each(session, func, params, key, ids):
+    """Call func(params, session) for each ID, passed as params[key].
+
+    The calls run in parallel, at most session.concurrency at once, and
+    they are not retried. The answer has one entry per ID in value, with
+    the value, changed and failed of its call. It has changed if one of the
+    calls has, and failed if one of them has failed.
+    """
+
+    async def _call(_id):
+        return await func(dict(params, **{key: _id}), session)
+
+    ids = list(dict.fromkeys(ids))
+    failures = []
+    results = await fetch_all(session, _call, ids, failures, retries=0)
+    errors = {i["item"]: i["error"] for i in failures}
+    value = []
+    for _id, result in zip(ids, results):
+        if result is None:
+            value.append(
+                {key: _id, "changed": False, "failed": True, "msg": errors.get(_id)}
+            )
+            continue
+        entry = {
+            key: _id,
+            "value": result.get("value"),
+            "changed": result.get("changed", False),
+            "failed": result.get("failed", False),
+        }
+        if result.get("msg"):
+            entry["msg"] = result["msg"]
+        value.append(entry)
+    return merge_results(value)
+
+
+def merge_results(entries):
+    """Return the answer of a module that has acted on several resources.
+
+    It has changed if one of the entries has, and failed if one of them has
+    failed.
+    """
+    return {
+        "value": entries,
+        "changed": any(i.get("changed") for i in entries),
+        "failed": any(i.get("failed") for i in entries),
+    }
+
+
+async def build_full_device_list(session, url, device_list, failures=None):
+    """Expand a list of IDs into the list of the devices details.
+
+    The devices that cannot be fetched are left out. Their ID and the error
+    are appended to failures, if it's a list.
+    """
     device_ids = []
 
     if isinstance(device_list, list):
@@ -234,36 +1610,207 @@ async def build_full_device_list(session, url, device_list):
             return device_list
         device_ids.append(fields[0])
 
-    tasks = [
-        asyncio.ensure_future(get_device_info(session, url, _id)) for _id in device_ids
-    ]
+    errors = []
+    full_devices = await fetch_all(
+        session, lambda _id: fetch_device_info(session, url, _id), device_ids, errors
+    )
+    if failures is not None:
+        failures += [{"id": i["item"], "error": i["error"]} for i in errors]
+    return [i for i in full_devices if i is not None]
 
-    return [await i for i in tasks]
 
+async def build_device_list(session, url, _json, id_key, details=None, fields=None):
+    """Prepare the answer of an _info module in list context.
 
-async def get_device_info(session, url, _id):
+    details is either "summary" (the entries returned by the list
+    end-point, without any other request), "full" (one more request per
+    entry to get its details) or None. In this case, the details are only
+    fetched if the list end-point has returned nothing but IDs, or if it
+    has not returned all the fields we are looking for.
+    fields restricts the keys of each entry (the ID is always kept).
+    """
+    entries = _json.get("value")
+    if not (
+        isinstance(entries, list)
+        and entries
+        and isinstance(entries[0], dict)
+        and isinstance(entries[0].get(id_key), str)
+    ):
+        return _json
+
+    if not details:
+        if fields:
+            details = "summary" if set(fields) <= set(entries[0]) else "full"
+        elif list(entries[0]) == [id_key]:
+            details = "full"
+        else:
+            details = "summary"
+
+    if details == "full":
+        url = url.split("?")[0]
+        errors = []
+        full_devices = await fetch_all(
+            session,
+            lambda entry: fetch_device_info(session, url, entry[id_key]),
+            entries,
+            errors,
+        )
+        _json = {
+            "value": [
+                dict(entry, **device["value"])
+                for entry, device in zip(entries, full_devices)
+                if device
+            ]
+        }
+        if errors:
+            _json["failures"] = [
+                {"id": i["item"][id_key], "error": i["error"]} for i in errors
+            ]
+
+    if fields:
+        _json["value"] = [
+            {k: v for k, v in i.items() if k in fields or k == id_key}
+            for i in _json["value"]
+        ]
+    return _json
+
+
+async def fetch_device_info(session, url, _id):
     async with session.get(url + "/" + _id) as resp:
-        if resp.status == 200:
-            _json = await resp.json()
-            if "value" not in _json:  # 7.0.2+
-                _json = {"value": _json}
-            _json["id"] = str(_id)
-            return _json
+        if resp.status != 200:
+            # The session has already retried the RETRY_STATUSES
+            retry = resp.status >= 500 and resp.status not in RETRY_STATUSES
+            raise FetchError(f"{url}/{_id}: status {resp.status}", retry=retry)
+        _json = await resp.json()
+        if "value" not in _json:  # 7.0.2+
+            _json = {"value": _json}
+        _json["id"] = str(_id)
+        return _json
+
+
+async def get_device_info(session, url, _id):
+    try:
+        return await fetch_device_info(session, url, _id)
+    except FetchError:
+        return None
+
+
+def get_list_filters(params, list_query):
+    """Map the parameters of a module on the filters of the list end-point.
+
+    e.g: name gives names, folder (or placement/folder) gives folders. We
+    only return filters if the name is known. Only the identity of the
+    resource is pushed down, the other parameters (e.g. the host or the
+    cluster of a VM) are the settings to apply, not search criteria.
+    """
+    filters = []
+    placement = params.get("placement") or {}
+    for i in list_query or []:
+        _filter = i[7:] if i.startswith("filter.") else i  # < 7.0.2
+        if _filter not in IDENTITY_FILTERS:
+            continue
+        value = params.get(_filter[:-1]) or placement.get(_filter[:-1])
+        if value and isinstance(value, str):
+            filters.append((i, value))
+    if not [i for i in filters if i[0] in ["names", "filter.names"]]:
+        return []
+    return filters
+
 
+async def exists(params, session, url, unicity_keys=None, list_query=None):
+    """Return the existing resource that matches the unicity keys, if any.
 
-async def exists(params, session, url, unicity_keys=None):
+    When the list has to be scanned, the device IDs are indexed by unicity
+    key. The index is shared by the sessions of the vCenter user and is
+    reused for INDEX_TTL seconds, or until a write request goes through the
+    same URL. The matching device is always fetched again, and the index
+    is rebuilt if it does not match anymore.
+    """
     if not unicity_keys:
         unicity_keys = []
 
-    unicity_keys += ["label", "pci_slot_number", "sata"]
+    filters = get_list_filters(params, list_query)
+    if filters and unicity_keys:
+        # The list end-point does the search, no need to fetch everything
+        id_key = unicity_keys[0]
+        devices = await list_devices(session, url + "?" + urlencode(filters))
+        if isinstance(devices, dict):  # 7.0.2 <
+            devices = devices.get("value")
+        for device in devices or []:
+            if isinstance(device, dict) and device.get(id_key):
+                try:
+                    return await fetch_device_info(session, url, device[id_key])
+                except FetchError as e:
+                    # Not the same thing as "not found", we would create a
+                    # duplicate
+                    exceptions = importlib.import_module(
+                        "ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions"
+                    )
+                    raise exceptions.EmbeddedModuleFailure(
+                        msg=f"Cannot read the existing resource: {e}"
+                    )
+        return
 
-    devices = await list_devices(session, url)
-    full_devices = await build_full_device_list(session, url, devices)
+    keys = unicity_keys + ["label", "pci_slot_number", "sata"]
+    key = (url.split("?")[0], tuple(keys))
+    built_at, index = session.indexes.get(key, (None, None))
+    full_devices = None
+    if built_at is None or time.monotonic() - built_at > INDEX_TTL:
+        devices = await list_devices(session, url)
+        failures = []
+        full_devices = await build_full_device_list(session, url, devices, failures)
+        if failures:
+            # A device we cannot read may be the one we look for, we don't
+            # want to create a duplicate
+            exceptions = importlib.import_module(
+                "ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions"
+            )
+            raise exceptions.EmbeddedModuleFailure(
+                msg="Cannot read the existing devices: {0}".format(
+                    ", ".join(f"{i['id']} ({i['error']})" for i in failures)
+                )
+            )
+        index = build_device_index(full_devices, keys)
+        session.indexes[key] = (time.monotonic(), index)
+
+    match = find_in_device_index(index, params, keys)
+    if not match:
+        return
+    position, _id = match
+    if full_devices is not None:
+        return full_devices[position]
+    # The index only gives the ID, the device may have changed since
+    device = None
+    if _id:
+        try:
+            device = await fetch_device_info(session, url, _id)
+        except FetchError:
+            pass
+    if device and find_in_device_index(
+        build_device_index([device], keys), params, keys
+    ):
+        return device
+    # The device is gone or does not match anymore, the index is stale
+    session.indexes.pop(key, None)
+    return await exists(params, session, url, unicity_keys, list_query)
 
-    for device in full_devices:
+
+def normalize_unicity_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
+def build_device_index(devices, unicity_keys):
+    """Index the devices by (unicity key, normalized value).
+
+    Each entry is (position of the device in the list, device ID). The
+    devices themselves are not kept, they would be outdated by the next
+    change.
+    """
+    index = {}
+    for position, device in enumerate(devices):
         for k in unicity_keys:
-            if not params.get(k):
-                continue
             if isinstance(device, dict):  # 7.0.2 <
                 v = device["value"].get(k)
             elif isinstance(device, list):
@@ -273,12 +1820,152 @@ async def exists(params, session, url, unicity_keys=None):
                     "ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions"
                 )
                 raise exceptions.EmbeddedModuleFailure(msg="Unexpect type")
+            if v is None:
+                continue
+            _id = device.get("id") if isinstance(device, dict) else None
+            index.setdefault((k, normalize_unicity_value(v)), (position, _id))
+    return index
+
+
+def find_in_device_index(index, params, unicity_keys):
+    """Return the (position, device ID) entry that matches params, if any."""
+    matches = []
+    for k in unicity_keys:
+        if not params.get(k):
+            continue
+        match = index.get((k, normalize_unicity_value(params[k])))
+        if match:
+            matches.append(match)
+    if matches:
+        # The first device of the list wins
+        return min(matches, key=lambda i: i[0])
+
+
+def normalize_value(value):
+    """Return value in a form that can be compared with the vCenter answer.
+
+    - the MAC addresses are lowercased,
+    - the lists of {"key": ID, "value": ...} (7.0.2 <) become a dict.
+
+    The scalars are converted by coerce_value(), depending on the other side
+    of the comparison.
+    """
+    if isinstance(value, list):
+        if value and all(
+            isinstance(i, dict) and sorted(i) == ["key", "value"] for i in value
+        ):
+            return {i["key"]: i["value"] for i in value}
+        return value
+    if isinstance(value, str) and MAC_ADDRESS_RE.match(value):
+        return value.lower()
+    return value
+
+
+def coerce_value(value, reference):
+    """Convert a string to the type of reference, if it is a bool or a number.
+
+    Ansible does not convert the suboptions that are not in the
+    argument_spec, e.g. "true" or "2" when vCenter answers True or 2. Two
+    strings are never converted, "0123" and "123" are two different names.
+    """
+    if not isinstance(value, str):
+        return value
+    if isinstance(reference, bool):
+        if value.lower() in ["true", "false"]:
+            return value.lower() == "true"
+    elif isinstance(reference, (int, float)):
+        if NUMBER_RE.match(value):
+            return float(value)
+    return value
+
+
+def is_same(current, desired, key=None):
+    """Tell if current already matches desired.
+
+    The dicts are compared on the keys of desired only, vCenter returns
+    many keys that are not set by the user. The None values of desired
+    match anything. The values go through normalize_value() first, the
+    scalars through coerce_value(), and the order of the lists is ignored,
+    unless the key is in ORDERED_LISTS.
+    """
+    if desired is None:
+        return True
+    current = normalize_value(current)
+    desired = normalize_value(desired)
+    if isinstance(desired, dict):
+        if not isinstance(current, dict):
+            return False
+        return all(is_same(current.get(k), v, k) for k, v in desired.items())
+    if isinstance(desired, list):
+        if not isinstance(current, list) or len(current) != len(desired):
+            return False
+        if key in ORDERED_LISTS:
+            return all(is_same(c, d) for c, d in zip(current, desired))
+        remaining = list(current)
+        for d in desired:
+            for i, c in enumerate(remaining):
+                if is_same(c, d):
+                    del remaining[i]
+                    break
+            else:
+                return False
+        return True
+    current = coerce_value(current, desired)
+    desired = coerce_value(desired, current)
+    # e.g: True == 1
+    if isinstance(current, bool) != isinstance(desired, bool):
+        return False
+    return current == desired
+
+
+def get_changes(current, desired):
+    """Return the part of desired that doesn't match current, see is_same().
+
+    Only the changed leaves of the nested dicts are kept, with their
+    DISCRIMINATOR_KEYS. A list that has changed is returned as a whole.
+    """
+    current = normalize_value(current)
+    if not isinstance(current, dict):
+        current = {}
+    changes = {}
+    for k, v in desired.items():
+        if is_same(current.get(k), v, k):
+            continue
+        if isinstance(v, dict) and isinstance(normalize_value(current.get(k)), dict):
+            changes[k] = get_changes(current[k], v)
+            for i in DISCRIMINATOR_KEYS:
+                if v.get(i) is not None:
+                    changes[k].setdefault(i, v[i])
+        else:
+            changes[k] = v
+    return changes
+
+
+def get_update_payload(current, payload):
+    """Return the PATCH payload of an _update() without the no-op changes.
+
+    The options are either at the root of the payload or under "spec".
+    """
+    changes = get_changes(current, {k: v for k, v in payload.items() if k != "spec"})
+    if isinstance(payload.get("spec"), dict):
+        changes["spec"] = get_changes(current, payload["spec"])
+    return changes
+
+
+def is_already_set(current, payload):
+    """Tell if the PUT of a _set() would leave the resource unchanged.
 
-            if isinstance(k, int) or isinstance(v, str):
-                k = str(k)
-                v = str(v)
-            if v == params.get(k):
-                return device
+    Some end-points answer the value of the only key of the payload, e.g.
+    /api/appliance/networking/dns/hostname answers the hostname.
+    """
+    if not payload:
+        return False
+    if isinstance(current, dict) and "value" in current:  # 7.0.2 <
+        current = current["value"]
+    if not isinstance(current, dict) and len(payload) == 1:
+        key, value = list(payload.items())[0]
+        return is_same(current, value, key)
+    return is_same(current, payload)
 
 
 def set_subkey(root, path, value):
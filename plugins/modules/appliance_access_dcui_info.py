@@ -28,6 +28,42 @@ options:
       C(VMWARE_PASSWORD) will be used instead.
     required: true
     type: str
+  vcenter_rest_cache:
+    default: false
+    description:
+    - Keep the answers of the read-mostly end-points (datacenter, folder, datastore,
+      network, cluster and resource pool) in memory for a short time, and reuse them
+      in the following module calls. A write on one of these end-points drops its
+      cached answers.
+    - This is only useful with the C(cloud.common) turbo mode.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CACHE) will be used instead.
+    type: bool
+  vcenter_rest_concurrency:
+    default: 20
+    description:
+    - Maximum number of requests that run in parallel against the vCenter when
+      the module needs to fetch a list of resources.
+    - This budget is shared by all the modules that target the same vCenter.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONCURRENCY) will be used instead.
+    type: int
+  vcenter_rest_connect_timeout:
+    default: 30
+    description:
+    - How many seconds to wait for the connection with the vCenter (TCP and TLS),
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECT_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_connection_limit:
+    default: 20
+    description:
+    - Maximum number of simultaneous connections with the vCenter. Use C(0) to
+      remove the limit.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECTION_LIMIT) will be used instead.
+    type: int
   vcenter_rest_log_file:
     description:
     - 'You can use this optional parameter to set the location of a log file. '
@@ -36,6 +72,83 @@ options:
     - 'If the value is not specified in the task, the value of '
     - environment variable C(VMWARE_REST_LOG_FILE) will be used instead.
     type: str
+  vcenter_rest_log_max_body_size:
+    default: -1
+    description:
+    - Maximum number of bytes of each answer to record in the log file. Use C(0)
+      to skip the answers and C(-1) to record them in full.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_BODY_SIZE) will be used instead.
+    type: int
+  vcenter_rest_log_max_file_size:
+    default: 0
+    description:
+    - Size in MiB after which the log file is rotated. Use C(0) to disable the
+      rotation.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_FILE_SIZE) will be used instead.
+    type: int
+  vcenter_rest_metrics:
+    default: false
+    description:
+    - Record the duration of each phase (DNS, connection, time to first byte, total)
+      of the HTTP requests done by the module. The timings are grouped by end-point
+      and returned in C(_debug_info).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_METRICS) will be used instead.
+    type: bool
+  vcenter_rest_rate_burst:
+    default: 10
+    description:
+    - How many requests can be sent at once, before C(vcenter_rest_rate_limit) applies.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_BURST) will be used instead.
+    type: int
+  vcenter_rest_rate_limit:
+    default: 0
+    description:
+    - The maximum number of requests per second sent to the vCenter, C(0) means no
+      limit. In turbo mode, the limit is shared by all the modules that use the same
+      vCenter and the same limit.
+    - The time spent waiting is reported in C(_debug_info) when C(vcenter_rest_metrics)
+      is enabled.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_LIMIT) will be used instead.
+    type: float
+  vcenter_rest_read_timeout:
+    default: 60
+    description:
+    - How many seconds a GET request can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_READ_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_retries:
+    default: 3
+    description:
+    - How many times a request is sent again when vCenter sheds it (HTTP 429, 502,
+      503 or 504) or when the connection fails. The module waits longer after each
+      attempt, or as long as the C(Retry-After) header asks.
+    - The GET requests are always retried. The other requests are only retried when
+      vCenter cannot have processed them (HTTP 429, connection failure).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RETRIES) will be used instead.
+    type: int
+  vcenter_rest_task_timeout:
+    default: 3600
+    description:
+    - How many seconds a request that starts a vCenter task (e.g. a VM clone) can take,
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_TASK_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_write_timeout:
+    default: 300
+    description:
+    - How many seconds a request that changes something (POST, PATCH, PUT or DELETE)
+      can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_WRITE_TIMEOUT) will be used instead.
+    type: float
   vcenter_username:
     description:
     - The vSphere vCenter username
@@ -51,6 +164,18 @@ options:
     - If the value is not specified in the task, the value of environment variable
       C(VMWARE_VALIDATE_CERTS) will be used instead.
     type: bool
+  wait_for:
+    description:
+    - A JMESPath condition on the C(value) returned by the module, e.g. C(ip_address)
+      or C(state == 'POWERED_ON'). The module queries vCenter again until the condition
+      is true, the delay between two attempts grows up to 15 seconds.
+    - Requires the C(jmespath) Python library.
+    type: str
+  wait_for_timeout:
+    default: 300
+    description:
+    - How many seconds to wait for the C(wait_for) condition.
+    type: int
 author:
 - Ansible Cloud Team (@ansible-collections)
 version_added: 1.0.0
@@ -104,6 +229,7 @@ from ansible_collections.vmware.vmware_rest.plugins.module_utils.vmware_rest imp
     open_session,
     prepare_payload,
     update_changed_flag,
+    wait_until,
 )
 
 
@@ -132,7 +258,87 @@ def prepare_argument_spec():
             required=False,
             fallback=(env_fallback, ["VMWARE_REST_LOG_FILE"]),
         ),
+        "vcenter_rest_concurrency": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONCURRENCY"]),
+        ),
+        "vcenter_rest_connection_limit": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECTION_LIMIT"]),
+        ),
+        "vcenter_rest_log_max_body_size": dict(
+            type="int",
+            required=False,
+            default=-1,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_BODY_SIZE"]),
+        ),
+        "vcenter_rest_log_max_file_size": dict(
+            type="int",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_FILE_SIZE"]),
+        ),
+        "vcenter_rest_metrics": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_METRICS"]),
+        ),
+        "vcenter_rest_cache": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_CACHE"]),
+        ),
+        "vcenter_rest_retries": dict(
+            type="int",
+            required=False,
+            default=3,
+            fallback=(env_fallback, ["VMWARE_REST_RETRIES"]),
+        ),
+        "vcenter_rest_rate_limit": dict(
+            type="float",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_LIMIT"]),
+        ),
+        "vcenter_rest_rate_burst": dict(
+            type="int",
+            required=False,
+            default=10,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_BURST"]),
+        ),
+        "vcenter_rest_connect_timeout": dict(
+            type="float",
+            required=False,
+            default=30,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECT_TIMEOUT"]),
+        ),
+        "vcenter_rest_read_timeout": dict(
+            type="float",
+            required=False,
+            default=60,
+            fallback=(env_fallback, ["VMWARE_REST_READ_TIMEOUT"]),
+        ),
+        "vcenter_rest_write_timeout": dict(
+            type="float",
+            required=False,
+            default=300,
+            fallback=(env_fallback, ["VMWARE_REST_WRITE_TIMEOUT"]),
+        ),
+        "vcenter_rest_task_timeout": dict(
+            type="float",
+            required=False,
+            default=3600,
+            fallback=(env_fallback, ["VMWARE_REST_TASK_TIMEOUT"]),
+        ),
     }
+    argument_spec["wait_for"] = {"type": "str"}
+    argument_spec["wait_for_timeout"] = {"type": "int", "default": 300}
 
     return argument_spec
 
@@ -157,10 +363,27 @@ async def main():
             vcenter_password=module.params["vcenter_password"],
             validate_certs=module.params["vcenter_validate_certs"],
             log_file=module.params["vcenter_rest_log_file"],
+            concurrency=module.params["vcenter_rest_concurrency"],
+            connection_limit=module.params["vcenter_rest_connection_limit"],
+            log_max_body_size=module.params["vcenter_rest_log_max_body_size"],
+            log_max_file_size=module.params["vcenter_rest_log_max_file_size"],
+            collect_metrics=module.params["vcenter_rest_metrics"],
+            cache=module.params["vcenter_rest_cache"],
+            retries=module.params["vcenter_rest_retries"],
+            rate_limit=module.params["vcenter_rest_rate_limit"],
+            rate_burst=module.params["vcenter_rest_rate_burst"],
+            connect_timeout=module.params["vcenter_rest_connect_timeout"],
+            read_timeout=module.params["vcenter_rest_read_timeout"],
+            write_timeout=module.params["vcenter_rest_write_timeout"],
+            task_timeout=module.params["vcenter_rest_task_timeout"],
         )
     except EmbeddedModuleFailure as err:
         module.fail_json(err.get_message())
-    result = await entry_point(module, session)
+    result = await wait_until(
+        lambda: entry_point(module, session),
+        module.params["wait_for"],
+        module.params["wait_for_timeout"],
+    )
     module.exit_json(**result)
 
 
@@ -0,0 +1,540 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2021, Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+module: vcenter_federated_info
+short_description: Lists the resources of several vCenters at once.
+description: Sends the same list query to several vCenters in parallel and merges
+  the results. Each entry comes with the C(vcenter) it has been found on. The queries
+  that match too many entries for a vCenter are split by datacenter (and by host
+  for the virtual machines). A vCenter that cannot be queried is reported in the
+  C(vcenters) answer with a warning, the module only fails if none of the vCenters
+  answers.
+options:
+  filters:
+    description:
+    - The filters of the list end-point, e.g. C(names) or C(power_states) for C(resource=vm).
+      They are the options of the matching C(_info) module, e.g. M(vmware.vmware_rest.vcenter_vm_info).
+    type: dict
+  resource:
+    choices:
+    - cluster
+    - datacenter
+    - datastore
+    - folder
+    - host
+    - network
+    - resource-pool
+    - vm
+    description:
+    - The type of resource to list.
+    required: true
+    type: str
+  vcenters:
+    description:
+    - The vCenters to query.
+    elements: dict
+    required: true
+    suboptions:
+      hostname:
+        description:
+        - The hostname or IP address of the vCenter.
+        required: true
+        type: str
+      password:
+        description:
+        - The password, I(vcenter_password) by default.
+        type: str
+      username:
+        description:
+        - The username, I(vcenter_username) by default.
+        type: str
+      validate_certs:
+        description:
+        - Whether to validate the SSL certificates, I(vcenter_validate_certs) by default.
+        type: bool
+    type: list
+  vcenter_password:
+    description:
+    - The vSphere vCenter password of the entries of I(vcenters) without their own
+      C(password).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_PASSWORD) will be used instead.
+    type: str
+  vcenter_rest_cache:
+    default: false
+    description:
+    - Keep the answers of the read-mostly end-points (datacenter, folder, datastore,
+      network, cluster and resource pool) in memory for a short time, and reuse them
+      in the following module calls. A write on one of these end-points drops its
+      cached answers.
+    - This is only useful with the C(cloud.common) turbo mode.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CACHE) will be used instead.
+    type: bool
+  vcenter_rest_concurrency:
+    default: 20
+    description:
+    - Maximum number of requests that run in parallel against the vCenter when
+      the module needs to fetch a list of resources.
+    - This budget is shared by all the modules that target the same vCenter.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONCURRENCY) will be used instead.
+    type: int
+  vcenter_rest_connect_timeout:
+    default: 30
+    description:
+    - How many seconds to wait for the connection with the vCenter (TCP and TLS),
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECT_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_connection_limit:
+    default: 20
+    description:
+    - Maximum number of simultaneous connections with the vCenter. Use C(0) to
+      remove the limit.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECTION_LIMIT) will be used instead.
+    type: int
+  vcenter_rest_log_file:
+    description:
+    - 'You can use this optional parameter to set the location of a log file. '
+    - 'This file will be used to record the HTTP REST interaction. '
+    - 'The file will be stored on the host that run the module. '
+    - 'If the value is not specified in the task, the value of '
+    - environment variable C(VMWARE_REST_LOG_FILE) will be used instead.
+    type: str
+  vcenter_rest_log_max_body_size:
+    default: -1
+    description:
+    - Maximum number of bytes of each answer to record in the log file. Use C(0)
+      to skip the answers and C(-1) to record them in full.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_BODY_SIZE) will be used instead.
+    type: int
+  vcenter_rest_log_max_file_size:
+    default: 0
+    description:
+    - Size in MiB after which the log file is rotated. Use C(0) to disable the
+      rotation.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_FILE_SIZE) will be used instead.
+    type: int
+  vcenter_rest_metrics:
+    default: false
+    description:
+    - Record the duration of each phase (DNS, connection, time to first byte, total)
+      of the HTTP requests done by the module. The timings are grouped by end-point
+      and returned in C(_debug_info).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_METRICS) will be used instead.
+    type: bool
+  vcenter_rest_rate_burst:
+    default: 10
+    description:
+    - How many requests can be sent at once, before C(vcenter_rest_rate_limit) applies.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_BURST) will be used instead.
+    type: int
+  vcenter_rest_rate_limit:
+    default: 0
+    description:
+    - The maximum number of requests per second sent to the vCenter, C(0) means no
+      limit. In turbo mode, the limit is shared by all the modules that use the same
+      vCenter and the same limit.
+    - The time spent waiting is reported in C(_debug_info) when C(vcenter_rest_metrics)
+      is enabled.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_LIMIT) will be used instead.
+    type: float
+  vcenter_rest_read_timeout:
+    default: 60
+    description:
+    - How many seconds a GET request can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_READ_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_retries:
+    default: 3
+    description:
+    - How many times a request is sent again when vCenter sheds it (HTTP 429, 502,
+      503 or 504) or when the connection fails. The module waits longer after each
+      attempt, or as long as the C(Retry-After) header asks.
+    - The GET requests are always retried. The other requests are only retried when
+      vCenter cannot have processed them (HTTP 429, connection failure).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RETRIES) will be used instead.
+    type: int
+  vcenter_rest_task_timeout:
+    default: 3600
+    description:
+    - How many seconds a request that starts a vCenter task (e.g. a VM clone) can take,
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_TASK_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_write_timeout:
+    default: 300
+    description:
+    - How many seconds a request that changes something (POST, PATCH, PUT or DELETE)
+      can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_WRITE_TIMEOUT) will be used instead.
+    type: float
+  vcenter_username:
+    description:
+    - The vSphere vCenter username of the entries of I(vcenters) without their own
+      C(username).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_USER) will be used instead.
+    type: str
+  vcenter_validate_certs:
+    default: true
+    description:
+    - Allows connection when SSL certificates are not valid. Set to C(false) when
+      certificates are not trusted.
+    - The default of the entries of I(vcenters) without their own C(validate_certs).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_VALIDATE_CERTS) will be used instead.
+    type: bool
+author:
+- Ansible Cloud Team (@ansible-collections)
+version_added: 1.1.0
+requirements:
+- python >= 3.6
+- aiohttp
+"""
+
+EXAMPLES = r"""
+- name: Look for a VM on all the vCenters
+  vmware.vmware_rest.vcenter_federated_info:
+    resource: vm
+    filters:
+      names:
+      - db-prod-01
+    vcenters:
+    - hostname: vcenter-eu.example.com
+    - hostname: vcenter-us.example.com
+    - hostname: vcenter-lab.example.com
+      username: administrator@lab.local
+      password: '{{ lab_password }}'
+  register: result
+
+- name: List the ESXi hosts of all the vCenters
+  vmware.vmware_rest.vcenter_federated_info:
+    resource: host
+    vcenters: '{{ my_vcenters }}'
+"""
+
+RETURN = r"""
+value:
+  description: The resources of all the vCenters, with the C(vcenter) they come from.
+  returned: On success
+  sample:
+  - memory_size_MiB: 1024
+    name: db-prod-01
+    power_state: POWERED_ON
+    vcenter: vcenter-eu.example.com
+    vm: vm-1049
+  type: list
+vcenters:
+  description: One entry per vCenter, with the C(count) of resources found, the C(duration)
+    of the query (in seconds) and whether it has C(failed), with the error in C(msg).
+    The module only fails if all the vCenters have failed, the other failures come
+    with a warning.
+  returned: always
+  sample:
+  - count: 1
+    duration: 0.812
+    failed: false
+    vcenter: vcenter-eu.example.com
+  - count: 0
+    duration: 0.655
+    failed: false
+    vcenter: vcenter-us.example.com
+  type: list
+"""
+
+import asyncio
+import time
+from urllib.parse import urlencode
+from ansible.module_utils.basic import env_fallback
+
+try:
+    from ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions import (
+        EmbeddedModuleFailure,
+    )
+    from ansible_collections.cloud.common.plugins.module_utils.turbo.module import (
+        AnsibleTurboModule as AnsibleModule,
+    )
+
+    AnsibleModule.collection_name = "vmware.vmware_rest"
+except ImportError:
+    from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.vmware.vmware_rest.plugins.module_utils.vmware_rest import (
+    FetchError,
+    list_partitioned,
+    open_session,
+)
+
+
+def prepare_argument_spec():
+    argument_spec = {
+        "vcenter_username": dict(
+            type="str", required=False, fallback=(env_fallback, ["VMWARE_USER"]),
+        ),
+        "vcenter_password": dict(
+            type="str",
+            required=False,
+            no_log=True,
+            fallback=(env_fallback, ["VMWARE_PASSWORD"]),
+        ),
+        "vcenter_validate_certs": dict(
+            type="bool",
+            required=False,
+            default=True,
+            fallback=(env_fallback, ["VMWARE_VALIDATE_CERTS"]),
+        ),
+        "vcenter_rest_log_file": dict(
+            type="str",
+            required=False,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_FILE"]),
+        ),
+        "vcenter_rest_concurrency": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONCURRENCY"]),
+        ),
+        "vcenter_rest_connection_limit": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECTION_LIMIT"]),
+        ),
+        "vcenter_rest_log_max_body_size": dict(
+            type="int",
+            required=False,
+            default=-1,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_BODY_SIZE"]),
+        ),
+        "vcenter_rest_log_max_file_size": dict(
+            type="int",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_FILE_SIZE"]),
+        ),
+        "vcenter_rest_metrics": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_METRICS"]),
+        ),
+        "vcenter_rest_cache": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_CACHE"]),
+        ),
+        "vcenter_rest_retries": dict(
+            type="int",
+            required=False,
+            default=3,
+            fallback=(env_fallback, ["VMWARE_REST_RETRIES"]),
+        ),
+        "vcenter_rest_rate_limit": dict(
+            type="float",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_LIMIT"]),
+        ),
+        "vcenter_rest_rate_burst": dict(
+            type="int",
+            required=False,
+            default=10,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_BURST"]),
+        ),
+        "vcenter_rest_connect_timeout": dict(
+            type="float",
+            required=False,
+            default=30,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECT_TIMEOUT"]),
+        ),
+        "vcenter_rest_read_timeout": dict(
+            type="float",
+            required=False,
+            default=60,
+            fallback=(env_fallback, ["VMWARE_REST_READ_TIMEOUT"]),
+        ),
+        "vcenter_rest_write_timeout": dict(
+            type="float",
+            required=False,
+            default=300,
+            fallback=(env_fallback, ["VMWARE_REST_WRITE_TIMEOUT"]),
+        ),
+        "vcenter_rest_task_timeout": dict(
+            type="float",
+            required=False,
+            default=3600,
+            fallback=(env_fallback, ["VMWARE_REST_TASK_TIMEOUT"]),
+        ),
+    }
+
+    argument_spec["filters"] = {"type": "dict"}
+    argument_spec["resource"] = {
+        "type": "str",
+        "choices": [
+            "cluster",
+            "datacenter",
+            "datastore",
+            "folder",
+            "host",
+            "network",
+            "resource-pool",
+            "vm",
+        ],
+        "required": True,
+    }
+    argument_spec["vcenters"] = {
+        "type": "list",
+        "elements": "dict",
+        "required": True,
+        "options": {
+            "hostname": {"type": "str", "required": True},
+            "password": {"type": "str", "no_log": True},
+            "username": {"type": "str"},
+            "validate_certs": {"type": "bool"},
+        },
+    }
+
+    return argument_spec
+
+
+async def main():
+    module_args = prepare_argument_spec()
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+    result = await entry_point(module)
+    module.exit_json(**result)
+
+
+def build_url(params):
+    url = ("https://{vcenter_hostname}" "/api/vcenter/{resource}").format(**params)
+    query = []
+    for k, v in (params["filters"] or {}).items():
+        for i in v if isinstance(v, list) else [v]:
+            query.append((k, str(i).lower() if isinstance(i, bool) else i))
+    if query:
+        url += "?" + urlencode(query)
+    return url
+
+
+async def connect(params, vcenter):
+    """Open a session on one of the vcenters, with the defaults of the module."""
+
+    def _get(key):
+        if vcenter[key] is None:
+            return params["vcenter_" + key]
+        return vcenter[key]
+
+    if not _get("username") or not _get("password"):
+        raise FetchError(f"No username or password for {vcenter['hostname']}")
+    try:
+        return await open_session(
+            vcenter_hostname=vcenter["hostname"],
+            vcenter_username=_get("username"),
+            vcenter_password=_get("password"),
+            validate_certs=_get("validate_certs"),
+            log_file=params["vcenter_rest_log_file"],
+            concurrency=params["vcenter_rest_concurrency"],
+            connection_limit=params["vcenter_rest_connection_limit"],
+            log_max_body_size=params["vcenter_rest_log_max_body_size"],
+            log_max_file_size=params["vcenter_rest_log_max_file_size"],
+            collect_metrics=params["vcenter_rest_metrics"],
+            cache=params["vcenter_rest_cache"],
+            retries=params["vcenter_rest_retries"],
+            rate_limit=params["vcenter_rest_rate_limit"],
+            rate_burst=params["vcenter_rest_rate_burst"],
+            connect_timeout=params["vcenter_rest_connect_timeout"],
+            read_timeout=params["vcenter_rest_read_timeout"],
+            write_timeout=params["vcenter_rest_write_timeout"],
+            task_timeout=params["vcenter_rest_task_timeout"],
+        )
+    except EmbeddedModuleFailure as err:
+        raise FetchError(err.get_message())
+    except asyncio.TimeoutError:
+        raise FetchError(f"Timeout while connecting to {vcenter['hostname']}")
+
+
+async def entry_point(module):
+    params = module.params
+
+    async def _query(vcenter):
+        start = time.monotonic()
+        summary = {"vcenter": vcenter["hostname"], "failed": False}
+        try:
+            items = await _list(vcenter)
+        except FetchError as e:
+            items = []
+            summary.update(failed=True, msg=str(e))
+        summary["count"] = len(items)
+        summary["duration"] = round(time.monotonic() - start, 3)
+        return summary, items
+
+    async def _list(vcenter):
+        session = await connect(params, vcenter)
+        url = build_url(dict(params, vcenter_hostname=vcenter["hostname"]))
+        # e.g: resource-pool -> resource_pool
+        id_key = params["resource"].replace("-", "_")
+        try:
+            _json, status = await list_partitioned(session, url, id_key)
+        except (session.aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchError(str(e) or repr(e))
+        except EmbeddedModuleFailure as err:
+            # e.g: the circuit breaker is open or the re-login has failed
+            raise FetchError(err.get_message())
+        _json = _json["value"]
+        if status != 200 or not isinstance(_json, list):
+            raise FetchError(f"Cannot list the {params['resource']}: {_json}")
+        return [dict(i, vcenter=vcenter["hostname"]) for i in _json]
+
+    answers = await asyncio.gather(*[_query(i) for i in params["vcenters"]])
+    result = merge_answers(answers)
+    if not result["failed"]:
+        for summary, items in answers:
+            if summary["failed"]:
+                module.warn(f"Cannot query {summary['vcenter']}: {summary['msg']}")
+    return result
+
+
+def merge_answers(answers):
+    """Merge the (summary, items) answers of the vCenters.
+
+    The answer of the vCenters that have failed is in their summary, the
+    module only fails if none of them has answered.
+    """
+    result = {
+        "value": [i for summary, items in answers for i in items],
+        "vcenters": [summary for summary, items in answers],
+        "changed": False,
+        "failed": False,
+    }
+    failed = [i["vcenter"] for i in result["vcenters"] if i["failed"]]
+    if failed and len(failed) == len(answers):
+        result["failed"] = True
+        result["msg"] = "Cannot query " + ", ".join(failed)
+    return result
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
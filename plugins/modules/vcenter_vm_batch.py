@@ -0,0 +1,1029 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2021, Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+module: vcenter_vm_batch
+short_description: Creates, clones or relocates a list of virtual machines.
+description: Creates or clones a list of virtual machines in parallel, deploys a
+  fleet of instant clones, or relocates a list of virtual machines. The virtual machines
+  that already exist are left untouched.
+options:
+  clone_spec:
+    description:
+    - The other keys of the instant clone spec of M(vmware.vmware_rest.vcenter_vm)
+      C(state=instant_clone), e.g. C(nics_to_update), C(disconnect_all_nics) or C(extra_config).
+      They are the same for all the clones.
+    type: dict
+  count:
+    description:
+    - The number of instant clones to deploy. Required with I(state=instant_clone).
+    type: int
+  max_moves_per_datastore:
+    default: 4
+    description:
+    - With I(state=relocate), the maximum number of virtual machines moved at the
+      same time out of a datastore.
+    type: int
+  max_moves_per_host:
+    default: 2
+    description:
+    - With I(state=relocate), the maximum number of virtual machines moved at the
+      same time out of an ESXi host. The virtual machines with neither a known host
+      nor a datastore share a single limit of the same size.
+    type: int
+  name_pattern:
+    description:
+    - The name of the instant clones. C({index}) is replaced by the number of the
+      clone, from I(start_index) to I(start_index) + I(count) - 1, e.g. C(desktop-{index:04d}).
+      Required with I(state=instant_clone).
+    type: str
+  placement:
+    description:
+    - With I(state=instant_clone), the placement of the instant clones (C(folder),
+      C(resource_pool) and C(datastore)). C(folder) is required, a clone already
+      exists if a virtual machine with the same name is in this folder.
+    - With I(state=relocate), the target placement (C(cluster), C(datastore), C(folder),
+      C(host) and C(resource_pool)) of the entries of I(vms) that don't have their
+      own.
+    type: dict
+  source:
+    description:
+    - The powered on virtual machine to instant clone. Required with I(state=instant_clone).
+    type: str
+  start_index:
+    default: 1
+    description:
+    - The first number of I(name_pattern).
+    type: int
+  state:
+    choices:
+    - instant_clone
+    - present
+    - relocate
+    default: present
+    description:
+    - C(present) creates the virtual machines of I(vms) that don't exist yet, or
+      clones them when their spec has a C(source).
+    - C(instant_clone) deploys I(count) instant clones of I(source). The number of
+      clones submitted in parallel adapts to the vCenter, it grows while the latency
+      of the clones stays low, and it is halved as soon as the latency grows or the
+      vCenter is overloaded. I(vcenter_rest_concurrency) is the upper limit.
+    - C(relocate) moves the virtual machines of I(vms) to their placement, in parallel
+      within the limits of I(max_moves_per_host) and I(max_moves_per_datastore),
+      and waits for the end of each move. A virtual machine that is already in its
+      target placement (each C(cluster), C(datastore), C(folder), C(host) and C(resource_pool)
+      that is set) is not moved.
+    type: str
+  vcenter_hostname:
+    description:
+    - The hostname or IP address of the vSphere vCenter
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_HOST) will be used instead.
+    required: true
+    type: str
+  vcenter_password:
+    description:
+    - The vSphere vCenter username
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_PASSWORD) will be used instead.
+    required: true
+    type: str
+  vcenter_rest_cache:
+    default: false
+    description:
+    - Keep the answers of the read-mostly end-points (datacenter, folder, datastore,
+      network, cluster and resource pool) in memory for a short time, and reuse them
+      in the following module calls. A write on one of these end-points drops its
+      cached answers.
+    - This is only useful with the C(cloud.common) turbo mode.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CACHE) will be used instead.
+    type: bool
+  vcenter_rest_concurrency:
+    default: 20
+    description:
+    - Maximum number of requests that run in parallel against the vCenter when
+      the module needs to fetch a list of resources.
+    - This budget is shared by all the modules that target the same vCenter.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONCURRENCY) will be used instead.
+    type: int
+  vcenter_rest_connect_timeout:
+    default: 30
+    description:
+    - How many seconds to wait for the connection with the vCenter (TCP and TLS),
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECT_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_connection_limit:
+    default: 20
+    description:
+    - Maximum number of simultaneous connections with the vCenter. Use C(0) to
+      remove the limit.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECTION_LIMIT) will be used instead.
+    type: int
+  vcenter_rest_log_file:
+    description:
+    - 'You can use this optional parameter to set the location of a log file. '
+    - 'This file will be used to record the HTTP REST interaction. '
+    - 'The file will be stored on the host that run the module. '
+    - 'If the value is not specified in the task, the value of '
+    - environment variable C(VMWARE_REST_LOG_FILE) will be used instead.
+    type: str
+  vcenter_rest_log_max_body_size:
+    default: -1
+    description:
+    - Maximum number of bytes of each answer to record in the log file. Use C(0)
+      to skip the answers and C(-1) to record them in full.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_BODY_SIZE) will be used instead.
+    type: int
+  vcenter_rest_log_max_file_size:
+    default: 0
+    description:
+    - Size in MiB after which the log file is rotated. Use C(0) to disable the
+      rotation.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_FILE_SIZE) will be used instead.
+    type: int
+  vcenter_rest_metrics:
+    default: false
+    description:
+    - Record the duration of each phase (DNS, connection, time to first byte, total)
+      of the HTTP requests done by the module. The timings are grouped by end-point
+      and returned in C(_debug_info).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_METRICS) will be used instead.
+    type: bool
+  vcenter_rest_rate_burst:
+    default: 10
+    description:
+    - How many requests can be sent at once, before C(vcenter_rest_rate_limit) applies.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_BURST) will be used instead.
+    type: int
+  vcenter_rest_rate_limit:
+    default: 0
+    description:
+    - The maximum number of requests per second sent to the vCenter, C(0) means no
+      limit. In turbo mode, the limit is shared by all the modules that use the same
+      vCenter and the same limit.
+    - The time spent waiting is reported in C(_debug_info) when C(vcenter_rest_metrics)
+      is enabled.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_LIMIT) will be used instead.
+    type: float
+  vcenter_rest_read_timeout:
+    default: 60
+    description:
+    - How many seconds a GET request can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_READ_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_retries:
+    default: 3
+    description:
+    - How many times a request is sent again when vCenter sheds it (HTTP 429, 502,
+      503 or 504) or when the connection fails. The module waits longer after each
+      attempt, or as long as the C(Retry-After) header asks.
+    - The GET requests are always retried. The other requests are only retried when
+      vCenter cannot have processed them (HTTP 429, connection failure).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RETRIES) will be used instead.
+    type: int
+  vcenter_rest_task_timeout:
+    default: 3600
+    description:
+    - How many seconds a request that starts a vCenter task (e.g. a VM clone) can take,
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_TASK_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_write_timeout:
+    default: 300
+    description:
+    - How many seconds a request that changes something (POST, PATCH, PUT or DELETE)
+      can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_WRITE_TIMEOUT) will be used instead.
+    type: float
+  vcenter_username:
+    description:
+    - The vSphere vCenter username
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_USER) will be used instead.
+    required: true
+    type: str
+  vcenter_validate_certs:
+    default: true
+    description:
+    - Allows connection when SSL certificates are not valid. Set to C(false) when
+      certificates are not trusted.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_VALIDATE_CERTS) will be used instead.
+    type: bool
+  vms:
+    description:
+    - The virtual machines to create. Each entry is the spec of a virtual machine,
+      with the keys of M(vmware.vmware_rest.vcenter_vm) (e.g. C(name), C(guest_OS),
+      C(placement), C(cpu), C(memory), C(disks)).
+    - An entry with a C(source) is cloned from this virtual machine, with the keys
+      of M(vmware.vmware_rest.vcenter_vm) C(state=clone) (e.g. C(power_on), C(disks_to_update)).
+    - A virtual machine already exists if a virtual machine with the same C(name)
+      is in the C(placement.folder) of the spec. C(placement.folder) is required,
+      a virtual machine with the same name in another folder is not a match.
+    - With I(state=relocate), the virtual machines to move. Each entry has the C(vm)
+      identifier and optionally its own C(placement) and C(disks), with the keys of
+      M(vmware.vmware_rest.vcenter_vm) C(state=relocate).
+    elements: dict
+    type: list
+author:
+- Ansible Cloud Team (@ansible-collections)
+version_added: 1.1.0
+requirements:
+- python >= 3.6
+- aiohttp
+"""
+
+EXAMPLES = r"""
+- name: Create two VM, unless they already exist
+  vmware.vmware_rest.vcenter_vm_batch:
+    vms:
+    - name: web1
+      guest_OS: RHEL_7_64
+      placement:
+        cluster: '{{ my_cluster_info.id }}'
+        datastore: '{{ my_datastore.datastore }}'
+        folder: '{{ my_virtual_machine_folder.folder }}'
+    - name: web2
+      guest_OS: RHEL_7_64
+      placement:
+        cluster: '{{ my_cluster_info.id }}'
+        datastore: '{{ my_datastore.datastore }}'
+        folder: '{{ my_virtual_machine_folder.folder }}'
+  register: web_vms
+
+- name: Deploy 1500 instant clones of the parent desktop
+  vmware.vmware_rest.vcenter_vm_batch:
+    state: instant_clone
+    source: '{{ parent_vm_info.id }}'
+    name_pattern: desktop-{index:04d}
+    count: 1500
+    placement:
+      folder: '{{ desktops_folder.folder }}'
+    vcenter_rest_concurrency: 50
+  register: desktops
+
+- name: Drain the datastore before its maintenance
+  vmware.vmware_rest.vcenter_vm_batch:
+    state: relocate
+    vms:
+    - vm: '{{ db1_info.id }}'
+    - vm: '{{ db2_info.id }}'
+    - vm: '{{ web1_info.id }}'
+      placement:
+        datastore: '{{ datastore3.datastore }}'
+    placement:
+      datastore: '{{ datastore2.datastore }}'
+    max_moves_per_datastore: 8
+
+- name: Clone a VM twice and start the clones
+  vmware.vmware_rest.vcenter_vm_batch:
+    vms:
+    - name: app1
+      source: '{{ web_vms.value[0].vm }}'
+      placement:
+        folder: '{{ my_virtual_machine_folder.folder }}'
+      power_on: true
+    - name: app2
+      source: '{{ web_vms.value[0].vm }}'
+      placement:
+        folder: '{{ my_virtual_machine_folder.folder }}'
+      power_on: true
+"""
+
+RETURN = r"""
+value:
+  description: One entry per virtual machine of I(vms), with its C(name), its C(vm) identifier,
+    and whether it has C(changed) or C(failed). The clones also come with the last state of their vCenter C(task).
+  returned: On success
+  sample:
+  - changed: true
+    failed: false
+    name: web1
+    vm: vm-1049
+  - changed: false
+    failed: false
+    name: web2
+    vm: vm-1012
+  type: list
+stats:
+  description:
+  - With I(state=instant_clone), the number of clones deployed, how long it took,
+    the deployment C(rate) (clones per second), the C(latency) of the clones (in
+    seconds) and the C(concurrency) reached.
+  - With I(state=relocate), the number of virtual machines moved, how long it took
+    and the duration of the C(moves) (in seconds). The entries of I(value) also come
+    with their source C(host) and C(datastores), and their C(timings), the time
+    spent C(queued) behind the other moves and the C(duration) of the move.
+  returned: When I(state=instant_clone) or I(state=relocate)
+  sample:
+    concurrency:
+      final: 12
+      highest: 16
+    count: 1500
+    duration: 612.4
+    failed: 0
+    latency:
+      avg: 4.512
+      max: 11.871
+      min: 2.104
+      p50: 4.218
+      p95: 7.935
+    rate: 2.449
+  type: dict
+"""
+
+import asyncio
+import re
+import time
+from urllib.parse import urlencode
+from ansible.module_utils.basic import env_fallback
+
+try:
+    from ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions import (
+        EmbeddedModuleFailure,
+    )
+    from ansible_collections.cloud.common.plugins.module_utils.turbo.module import (
+        AnsibleTurboModule as AnsibleModule,
+    )
+
+    AnsibleModule.collection_name = "vmware.vmware_rest"
+except ImportError:
+    from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.vmware.vmware_rest.plugins.module_utils.vmware_rest import (
+    AdaptiveConcurrency,
+    FetchError,
+    RETRY_STATUSES,
+    fetch_all,
+    get_durations_summary,
+    list_devices,
+    merge_results,
+    open_session,
+    update_changed_flag,
+    wait_for_task,
+)
+
+# vCenter (and the proxies in front of it) limit the size of the URL, the
+# names are looked up in batches
+NAMES_PER_REQUEST = 100
+# e.g: [datastore1] vm1/vm1.vmdk
+DATASTORE_NAME_RE = re.compile(r"^\[(.+?)\]")
+# The placement keys checked with a filter of the list end-point, see
+# locate_vms()
+PLACEMENT_FILTERS = {
+    "cluster": "clusters",
+    "folder": "folders",
+    "resource_pool": "resource_pools",
+}
+
+
+def prepare_argument_spec():
+    argument_spec = {
+        "vcenter_hostname": dict(
+            type="str", required=True, fallback=(env_fallback, ["VMWARE_HOST"]),
+        ),
+        "vcenter_username": dict(
+            type="str", required=True, fallback=(env_fallback, ["VMWARE_USER"]),
+        ),
+        "vcenter_password": dict(
+            type="str",
+            required=True,
+            no_log=True,
+            fallback=(env_fallback, ["VMWARE_PASSWORD"]),
+        ),
+        "vcenter_validate_certs": dict(
+            type="bool",
+            required=False,
+            default=True,
+            fallback=(env_fallback, ["VMWARE_VALIDATE_CERTS"]),
+        ),
+        "vcenter_rest_log_file": dict(
+            type="str",
+            required=False,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_FILE"]),
+        ),
+        "vcenter_rest_concurrency": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONCURRENCY"]),
+        ),
+        "vcenter_rest_connection_limit": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECTION_LIMIT"]),
+        ),
+        "vcenter_rest_log_max_body_size": dict(
+            type="int",
+            required=False,
+            default=-1,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_BODY_SIZE"]),
+        ),
+        "vcenter_rest_log_max_file_size": dict(
+            type="int",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_FILE_SIZE"]),
+        ),
+        "vcenter_rest_metrics": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_METRICS"]),
+        ),
+        "vcenter_rest_cache": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_CACHE"]),
+        ),
+        "vcenter_rest_retries": dict(
+            type="int",
+            required=False,
+            default=3,
+            fallback=(env_fallback, ["VMWARE_REST_RETRIES"]),
+        ),
+        "vcenter_rest_rate_limit": dict(
+            type="float",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_LIMIT"]),
+        ),
+        "vcenter_rest_rate_burst": dict(
+            type="int",
+            required=False,
+            default=10,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_BURST"]),
+        ),
+        "vcenter_rest_connect_timeout": dict(
+            type="float",
+            required=False,
+            default=30,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECT_TIMEOUT"]),
+        ),
+        "vcenter_rest_read_timeout": dict(
+            type="float",
+            required=False,
+            default=60,
+            fallback=(env_fallback, ["VMWARE_REST_READ_TIMEOUT"]),
+        ),
+        "vcenter_rest_write_timeout": dict(
+            type="float",
+            required=False,
+            default=300,
+            fallback=(env_fallback, ["VMWARE_REST_WRITE_TIMEOUT"]),
+        ),
+        "vcenter_rest_task_timeout": dict(
+            type="float",
+            required=False,
+            default=3600,
+            fallback=(env_fallback, ["VMWARE_REST_TASK_TIMEOUT"]),
+        ),
+    }
+
+    argument_spec["clone_spec"] = {"type": "dict"}
+    argument_spec["count"] = {"type": "int"}
+    argument_spec["max_moves_per_datastore"] = {"type": "int", "default": 4}
+    argument_spec["max_moves_per_host"] = {"type": "int", "default": 2}
+    argument_spec["name_pattern"] = {"type": "str"}
+    argument_spec["placement"] = {"type": "dict"}
+    argument_spec["source"] = {"type": "str"}
+    argument_spec["start_index"] = {"type": "int", "default": 1}
+    argument_spec["state"] = {
+        "type": "str",
+        "choices": ["instant_clone", "present", "relocate"],
+        "default": "present",
+    }
+    argument_spec["vms"] = {"type": "list", "elements": "dict"}
+
+    return argument_spec
+
+
+async def main():
+    required_if = list(
+        [
+            ["state", "present", ["vms"]],
+            ["state", "instant_clone", ["source", "name_pattern", "count"]],
+            ["state", "relocate", ["vms"]],
+        ]
+    )
+
+    module_args = prepare_argument_spec()
+    module = AnsibleModule(
+        argument_spec=module_args, required_if=required_if, supports_check_mode=True
+    )
+    if not module.params["vcenter_hostname"]:
+        module.fail_json("vcenter_hostname cannot be empty")
+    if not module.params["vcenter_username"]:
+        module.fail_json("vcenter_username cannot be empty")
+    if not module.params["vcenter_password"]:
+        module.fail_json("vcenter_password cannot be empty")
+    try:
+        session = await open_session(
+            vcenter_hostname=module.params["vcenter_hostname"],
+            vcenter_username=module.params["vcenter_username"],
+            vcenter_password=module.params["vcenter_password"],
+            validate_certs=module.params["vcenter_validate_certs"],
+            log_file=module.params["vcenter_rest_log_file"],
+            concurrency=module.params["vcenter_rest_concurrency"],
+            connection_limit=module.params["vcenter_rest_connection_limit"],
+            log_max_body_size=module.params["vcenter_rest_log_max_body_size"],
+            log_max_file_size=module.params["vcenter_rest_log_max_file_size"],
+            collect_metrics=module.params["vcenter_rest_metrics"],
+            cache=module.params["vcenter_rest_cache"],
+            retries=module.params["vcenter_rest_retries"],
+            rate_limit=module.params["vcenter_rest_rate_limit"],
+            rate_burst=module.params["vcenter_rest_rate_burst"],
+            connect_timeout=module.params["vcenter_rest_connect_timeout"],
+            read_timeout=module.params["vcenter_rest_read_timeout"],
+            write_timeout=module.params["vcenter_rest_write_timeout"],
+            task_timeout=module.params["vcenter_rest_task_timeout"],
+        )
+    except EmbeddedModuleFailure as err:
+        module.fail_json(err.get_message())
+    result = await entry_point(module, session)
+    module.exit_json(**result)
+
+
+def build_url(params):
+    return ("https://{vcenter_hostname}" "/api/vcenter/vm").format(**params)
+
+
+async def entry_point(module, session):
+    func = globals()["_" + module.params["state"]]
+    return await func(module.params, session, module.check_mode)
+
+
+async def find_existing(params, session, specs):
+    """Return the IDs of the VM of specs that already exist, by (folder, name).
+
+    The names are looked up with the names and folders filters of the list
+    end-point, a few requests for the whole list. Each spec must have a
+    placement folder: the names are only unique within a folder.
+    """
+    names_by_folder = {}
+    for spec in specs:
+        folder = spec["placement"]["folder"]
+        names_by_folder.setdefault(folder, set()).add(spec["name"])
+    queries = []
+    for folder, names in names_by_folder.items():
+        names = sorted(names)
+        for i in range(0, len(names), NAMES_PER_REQUEST):
+            query = [("names", n) for n in names[i : i + NAMES_PER_REQUEST]]
+            query.append(("folders", folder))
+            queries.append((folder, query))
+
+    async def _list(item):
+        folder, query = item
+        _json = await list_devices(session, build_url(params) + "?" + urlencode(query))
+        if not isinstance(_json, list):
+            raise FetchError(f"Cannot list the VM: {_json}")
+        return [((folder, vm["name"]), vm["vm"]) for vm in _json]
+
+    failures = []
+    results = await fetch_all(session, _list, queries, failures)
+    if failures:
+        raise FetchError(failures[0]["error"])
+    return dict(i for result in results for i in result)
+
+
+async def _present(params, session, check_mode=False):
+    specs = params["vms"]
+    if not all(spec.get("name") for spec in specs):
+        return {"failed": True, "msg": "Each entry of vms needs a name"}
+    if not all((spec.get("placement") or {}).get("folder") for spec in specs):
+        return {"failed": True, "msg": "Each entry of vms needs a placement.folder"}
+    try:
+        existing = await find_existing(params, session, specs)
+    except FetchError as e:
+        return {"failed": True, "msg": str(e)}
+
+    results = {}
+    to_deploy = []
+    for index, spec in enumerate(specs):
+        folder = spec["placement"]["folder"]
+        if (folder, spec["name"]) in existing:
+            results[index] = {
+                "name": spec["name"],
+                "vm": existing[(folder, spec["name"])],
+                "changed": False,
+                "failed": False,
+            }
+        elif check_mode:
+            results[index] = {"name": spec["name"], "changed": True, "failed": False}
+        else:
+            to_deploy.append(index)
+
+    # The clones keep their slot while vCenter runs the task, but not the
+    # concurrency budget of the vCenter: it is only taken for the requests.
+    deployments = asyncio.Semaphore(session.concurrency)
+
+    async def _deploy(index):
+        spec = specs[index]
+        async with deployments:
+            try:
+                result = (
+                    await _clone(params, session, spec)
+                    if spec.get("source")
+                    else await _create(params, session, spec)
+                )
+            except (session.aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result = {"failed": True, "msg": str(e) or repr(e)}
+        entry = {
+            "name": spec["name"],
+            "changed": result.get("changed", False),
+            "failed": result.get("failed", False),
+        }
+        if result.get("failed"):
+            entry["msg"] = result.get("msg") or result.get("value")
+        else:
+            entry["vm"] = result.get("value")
+        if "task" in result:
+            entry["task"] = result["task"]
+        return entry
+
+    deployed = await asyncio.gather(*[_deploy(index) for index in to_deploy])
+    for index, entry in zip(to_deploy, deployed):
+        results[index] = entry
+    return merge_results([results[i] for i in range(len(specs))])
+
+
+async def _create(params, session, spec):
+    async with session.semaphore, session.post(build_url(params), json=spec) as resp:
+        try:
+            if resp.headers["Content-Type"] == "application/json":
+                _json = await resp.json()
+        except KeyError:
+            _json = {}
+        if "value" not in _json:  # 7.0.2
+            _json = {"value": _json}
+        return await update_changed_flag(_json, resp.status, "create")
+
+
+async def _clone(params, session, spec):
+    _url = build_url(params) + "?action=clone&vmw-task=true"
+    async with session.semaphore, session.post(_url, json=spec) as resp:
+        try:
+            if resp.headers["Content-Type"] == "application/json":
+                _json = await resp.json()
+        except KeyError:
+            _json = {}
+        if "value" not in _json:  # 7.0.2
+            _json = {"value": _json}
+        _json = await update_changed_flag(_json, resp.status, "clone")
+    # The task can run for a long time, don't hold the semaphore meanwhile
+    if resp.status in [200, 201, 202]:
+        _json = await wait_for_task(session, params["vcenter_hostname"], _json)
+    return _json
+
+
+async def _instant_clone(params, session, check_mode=False):
+    if not (params["placement"] or {}).get("folder"):
+        return {"failed": True, "msg": "The placement needs a folder"}
+    try:
+        names = [
+            params["name_pattern"].format(index=i)
+            for i in range(
+                params["start_index"], params["start_index"] + params["count"]
+            )
+        ]
+    except (IndexError, KeyError, ValueError) as e:
+        return {"failed": True, "msg": f"Invalid name_pattern: {e!r}"}
+    specs = [
+        dict(
+            params["clone_spec"] or {},
+            name=name,
+            source=params["source"],
+            placement=params["placement"],
+        )
+        for name in names
+    ]
+    try:
+        existing = await find_existing(params, session, specs)
+    except FetchError as e:
+        return {"failed": True, "msg": str(e)}
+
+    folder = params["placement"]["folder"]
+    results = [
+        {"name": spec["name"], "changed": False, "failed": False} for spec in specs
+    ]
+    to_deploy = []
+    for index, result in enumerate(results):
+        if (folder, result["name"]) in existing:
+            result["vm"] = existing[(folder, result["name"])]
+        elif check_mode:
+            result["changed"] = True
+        else:
+            to_deploy.append(index)
+    if check_mode or not to_deploy:
+        return merge_results(results)
+
+    limiter = AdaptiveConcurrency(session.concurrency)
+    pending = iter(to_deploy)
+    latencies = []
+
+    async def _worker():
+        for index in pending:
+            result = results[index]
+            token = await limiter.acquire()
+            latency = None
+            overloaded = False
+            try:
+                async with session.semaphore:
+                    start = time.monotonic()
+                    _json = await _send_instant_clone(params, session, specs[index])
+                    latency = time.monotonic() - start
+                status = _json["_debug_info"]["status"]
+                overloaded = status in RETRY_STATUSES
+                result["changed"] = _json.get("changed", False)
+                result["failed"] = _json.get("failed") or status not in [200, 201]
+                if result["failed"]:
+                    result["msg"] = _json["value"]
+                    latency = None
+                else:
+                    result["vm"] = _json["value"]
+                    result["latency"] = round(latency, 3)
+                    latencies.append(latency)
+            except (session.aiohttp.ClientError, asyncio.TimeoutError) as e:
+                overloaded = True
+                latency = None
+                result["failed"] = True
+                result["msg"] = str(e) or repr(e)
+            finally:
+                await limiter.release(token, latency, overloaded)
+
+    start = time.monotonic()
+    await asyncio.gather(*[_worker() for i in range(limiter.maximum)])
+    duration = time.monotonic() - start
+
+    _json = merge_results(results)
+    _json["stats"] = {
+        "count": len(latencies),
+        "failed": len([i for i in to_deploy if results[i]["failed"]]),
+        "duration": round(duration, 3),
+        "rate": round(len(latencies) / duration, 3) if duration else 0,
+        "latency": get_durations_summary(latencies),
+        "concurrency": {"final": limiter.limit, "highest": limiter.highest},
+    }
+    return _json
+
+
+async def _send_instant_clone(params, session, spec):
+    _url = build_url(params) + "?action=instant-clone"
+    async with session.post(_url, json=spec) as resp:
+        try:
+            if resp.headers["Content-Type"] == "application/json":
+                _json = await resp.json()
+        except KeyError:
+            _json = {}
+        if "value" not in _json:  # 7.0.2
+            _json = {"value": _json}
+        return await update_changed_flag(_json, resp.status, "create")
+
+
+async def locate_vms(params, session, ids, targets=None):
+    """Return the host and the datastores of each VM of ids.
+
+    The VMs of each host are listed, the datastores come from the disks of
+    each VM. A VM that cannot be found gets a msg. targets maps the
+    (placement key, value) of PLACEMENT_FILTERS (e.g. ("cluster",
+    "domain-c8")) on the VMs to check, the ones that are in it get it in
+    their placements.
+    """
+    base_url = ("https://{vcenter_hostname}" "/api/vcenter").format(**params)
+    hosts = await list_devices(session, base_url + "/host")
+    datastores = await list_devices(session, base_url + "/datastore")
+    if not isinstance(hosts, list):
+        raise FetchError(f"Cannot list the hosts: {hosts}")
+    if not isinstance(datastores, list):
+        raise FetchError(f"Cannot list the datastores: {datastores}")
+    datastore_ids = {i["name"]: i["datastore"] for i in datastores}
+    locations = {i: {"host": None, "datastores": [], "placements": set()} for i in ids}
+
+    async def _list_host_vms(host):
+        query = urlencode([("hosts", host["host"])])
+        _json = await list_devices(session, build_url(params) + "?" + query)
+        if not isinstance(_json, list):
+            raise FetchError(f"Cannot list the VM of {host['host']}: {_json}")
+        for vm in _json:
+            if vm["vm"] in locations:
+                locations[vm["vm"]]["host"] = host["host"]
+
+    async def _get_vm_datastores(vm):
+        _json = await list_devices(session, build_url(params) + "/" + vm)
+        if "value" in _json:  # 7.0.2 <
+            _json = _json["value"]
+        if "disks" not in _json:
+            locations[vm]["msg"] = _json
+            return
+        disks = _json["disks"]
+        if isinstance(disks, list):  # 7.0.2 <
+            disks = {i["key"]: i["value"] for i in disks}
+        names = set()
+        for disk in disks.values():
+            m = DATASTORE_NAME_RE.match(
+                (disk.get("backing") or {}).get("vmdk_file") or ""
+            )
+            if m:
+                names.add(m.group(1))
+        locations[vm]["datastores"] = sorted(datastore_ids.get(n, n) for n in names)
+
+    async def _list_target_vms(item):
+        (key, value), vms = item
+        query = [(PLACEMENT_FILTERS[key], value)] + [("vms", i) for i in vms]
+        _json = await list_devices(session, build_url(params) + "?" + urlencode(query))
+        if not isinstance(_json, list):
+            raise FetchError(f"Cannot list the VM of {value}: {_json}")
+        for vm in _json:
+            if vm["vm"] in locations:
+                locations[vm["vm"]]["placements"].add((key, value))
+
+    # The vms filter keeps the answers small, whatever the size of the
+    # cluster or the folder
+    target_queries = [
+        (target, vms[i : i + NAMES_PER_REQUEST])
+        for target, vms in (targets or {}).items()
+        for i in range(0, len(vms), NAMES_PER_REQUEST)
+    ]
+    failures = []
+    await fetch_all(session, _list_host_vms, hosts, failures)
+    await fetch_all(session, _get_vm_datastores, ids, failures)
+    await fetch_all(session, _list_target_vms, target_queries, failures)
+    if failures:
+        raise FetchError(failures[0]["error"])
+    return locations
+
+
+def is_in_place(location, placement):
+    """Tell if a VM is already in every part of placement that is set.
+
+    The VM has to be on the host, all its disks on the datastore, and in the
+    cluster, the folder and the resource pool of placement.
+    """
+    keys = [
+        k for k in ["host", "datastore"] + list(PLACEMENT_FILTERS) if placement.get(k)
+    ]
+    if not keys:
+        return False
+    for k in keys:
+        if k == "host":
+            if placement[k] != location["host"]:
+                return False
+        elif k == "datastore":
+            if location["datastores"] != [placement[k]]:
+                return False
+        elif (k, placement[k]) not in location["placements"]:
+            return False
+    return True
+
+
+async def _relocate(params, session, check_mode=False):
+    entries = params["vms"]
+    if not all(entry.get("vm") for entry in entries):
+        return {"failed": True, "msg": "Each entry of vms needs a vm"}
+    if not all(entry.get("placement") or params["placement"] for entry in entries):
+        return {"failed": True, "msg": "Each entry of vms needs a placement"}
+    targets = {}
+    for entry in entries:
+        placement = entry.get("placement") or params["placement"]
+        for key in PLACEMENT_FILTERS:
+            if placement.get(key):
+                vms = targets.setdefault((key, placement[key]), [])
+                if entry["vm"] not in vms:
+                    vms.append(entry["vm"])
+    try:
+        locations = await locate_vms(
+            params, session, sorted(set(entry["vm"] for entry in entries)), targets
+        )
+    except FetchError as e:
+        return {"failed": True, "msg": str(e)}
+
+    # The moves take the slot of their host first, then the slots of their
+    # datastores in order, so two moves never wait for each other. The VMs
+    # without a known host or datastore share a single max_moves_per_host
+    # slot.
+    host_slots = {}
+    datastore_slots = {}
+    unlocated_slot = asyncio.Semaphore(params["max_moves_per_host"])
+
+    def _get_slots(location):
+        slots = []
+        if location["host"]:
+            slots.append(
+                host_slots.setdefault(
+                    location["host"], asyncio.Semaphore(params["max_moves_per_host"])
+                )
+            )
+        for datastore in location["datastores"]:
+            slots.append(
+                datastore_slots.setdefault(
+                    datastore, asyncio.Semaphore(params["max_moves_per_datastore"])
+                )
+            )
+        return slots or [unlocated_slot]
+
+    async def _move(entry):
+        location = locations[entry["vm"]]
+        spec = {k: v for k, v in entry.items() if k != "vm"}
+        spec["placement"] = spec.get("placement") or params["placement"]
+        result = {
+            "vm": entry["vm"],
+            "host": location["host"],
+            "datastores": location["datastores"],
+            "changed": False,
+            "failed": False,
+        }
+        if location.get("msg"):
+            result.update(failed=True, msg=location["msg"])
+            return result
+        if not spec.get("disks") and is_in_place(location, spec["placement"]):
+            return result
+        if check_mode:
+            result["changed"] = True
+            return result
+
+        start = time.monotonic()
+        slots = _get_slots(location)
+        for slot in slots:
+            await slot.acquire()
+        queued = time.monotonic() - start
+        try:
+            _json = await _send_relocate(params, session, entry["vm"], spec)
+        except (session.aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _json = {"failed": True, "msg": str(e) or repr(e)}
+        finally:
+            for slot in slots:
+                slot.release()
+        result["changed"] = _json.get("changed", False)
+        result["failed"] = _json.get("failed", False)
+        if result["failed"]:
+            result["msg"] = _json.get("msg") or _json.get("value")
+        if "task" in _json:
+            result["task"] = _json["task"]
+        result["timings"] = {
+            "queued": round(queued, 3),
+            "duration": round(time.monotonic() - start - queued, 3),
+        }
+        return result
+
+    start = time.monotonic()
+    results = await asyncio.gather(*[_move(entry) for entry in entries])
+    duration = time.monotonic() - start
+
+    _json = merge_results(results)
+    if not check_mode:
+        moves = [i for i in results if "timings" in i]
+        _json["stats"] = {
+            "count": len([i for i in moves if not i["failed"]]),
+            "failed": len([i for i in moves if i["failed"]]),
+            "duration": round(duration, 3),
+            "moves": get_durations_summary(
+                [i["timings"]["duration"] for i in moves if not i["failed"]]
+            ),
+        }
+    return _json
+
+
+async def _send_relocate(params, session, vm, spec):
+    _url = build_url(params) + "/" + vm + "?action=relocate&vmw-task=true"
+    async with session.post(_url, json=spec) as resp:
+        try:
+            if resp.headers["Content-Type"] == "application/json":
+                _json = await resp.json()
+        except KeyError:
+            _json = {}
+        if "value" not in _json:  # 7.0.2
+            _json = {"value": _json}
+        _json = await update_changed_flag(_json, resp.status, "relocate")
+        if resp.status in [200, 201, 202]:
+            return await wait_for_task(session, params["vcenter_hostname"], _json)
+        _json["failed"] = True
+        return _json
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
@@ -0,0 +1,636 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright: (c) 2021, Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+module: vcenter_vm_hardware_reconcile
+short_description: Converges the virtual hardware of a virtual machine.
+description: Reads the virtual hardware of a virtual machine once, compares it with
+  the expected CPU, memory, boot options, disks, network adapters and CD-ROMs, and
+  only applies the differences. The changes are applied one after the other, vCenter
+  does not reconfigure a virtual machine twice at the same time.
+options:
+  boot:
+    description:
+    - The expected boot options, with the keys of M(vmware.vmware_rest.vcenter_vm_hardware_boot)
+      (e.g. C(type), C(delay), C(enter_setup_mode)).
+    type: dict
+  cdroms:
+    description:
+    - The expected CD-ROMs, with the keys of M(vmware.vmware_rest.vcenter_vm_hardware_cdrom)
+      (e.g. C(type), C(backing), C(start_connected)).
+    - See I(disks) for how the devices are matched.
+    elements: dict
+    type: list
+  cpu:
+    description:
+    - The expected CPU configuration, with the keys of M(vmware.vmware_rest.vcenter_vm_hardware_cpu)
+      (e.g. C(count), C(cores_per_socket), C(hot_add_enabled)).
+    type: dict
+  disks:
+    description:
+    - The expected disks, with the keys of M(vmware.vmware_rest.vcenter_vm_hardware_disk)
+      (e.g. C(type), C(scsi), C(backing), C(new_vmdk)).
+    - An entry matches the existing device with the same C(label), or the same
+      complete address (C(scsi), C(sata), C(nvme) or C(ide), e.g. both C(bus) and
+      C(unit)). The other entries are created, an entry without label or complete
+      address is created again at each run.
+    - The module fails if a matched device differs on a key that vCenter cannot
+      update, e.g. C(type).
+    - The existing devices that are not listed are left untouched.
+    elements: dict
+    type: list
+  memory:
+    description:
+    - The expected memory configuration, with the keys of M(vmware.vmware_rest.vcenter_vm_hardware_memory)
+      (e.g. C(size_MiB), C(hot_add_enabled)).
+    type: dict
+  nics:
+    description:
+    - The expected network adapters, with the keys of M(vmware.vmware_rest.vcenter_vm_hardware_ethernet)
+      (e.g. C(type), C(backing), C(start_connected)).
+    - An entry also matches the existing adapter with the same C(mac_address), see
+      I(disks) for the other rules.
+    elements: dict
+    type: list
+  vcenter_hostname:
+    description:
+    - The hostname or IP address of the vSphere vCenter
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_HOST) will be used instead.
+    required: true
+    type: str
+  vcenter_password:
+    description:
+    - The vSphere vCenter username
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_PASSWORD) will be used instead.
+    required: true
+    type: str
+  vcenter_rest_cache:
+    default: false
+    description:
+    - Keep the answers of the read-mostly end-points (datacenter, folder, datastore,
+      network, cluster and resource pool) in memory for a short time, and reuse them
+      in the following module calls. A write on one of these end-points drops its
+      cached answers.
+    - This is only useful with the C(cloud.common) turbo mode.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CACHE) will be used instead.
+    type: bool
+  vcenter_rest_concurrency:
+    default: 20
+    description:
+    - Maximum number of requests that run in parallel against the vCenter when
+      the module needs to fetch a list of resources.
+    - This budget is shared by all the modules that target the same vCenter.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONCURRENCY) will be used instead.
+    type: int
+  vcenter_rest_connect_timeout:
+    default: 30
+    description:
+    - How many seconds to wait for the connection with the vCenter (TCP and TLS),
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECT_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_connection_limit:
+    default: 20
+    description:
+    - Maximum number of simultaneous connections with the vCenter. Use C(0) to
+      remove the limit.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECTION_LIMIT) will be used instead.
+    type: int
+  vcenter_rest_log_file:
+    description:
+    - 'You can use this optional parameter to set the location of a log file. '
+    - 'This file will be used to record the HTTP REST interaction. '
+    - 'The file will be stored on the host that run the module. '
+    - 'If the value is not specified in the task, the value of '
+    - environment variable C(VMWARE_REST_LOG_FILE) will be used instead.
+    type: str
+  vcenter_rest_log_max_body_size:
+    default: -1
+    description:
+    - Maximum number of bytes of each answer to record in the log file. Use C(0)
+      to skip the answers and C(-1) to record them in full.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_BODY_SIZE) will be used instead.
+    type: int
+  vcenter_rest_log_max_file_size:
+    default: 0
+    description:
+    - Size in MiB after which the log file is rotated. Use C(0) to disable the
+      rotation.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_FILE_SIZE) will be used instead.
+    type: int
+  vcenter_rest_metrics:
+    default: false
+    description:
+    - Record the duration of each phase (DNS, connection, time to first byte, total)
+      of the HTTP requests done by the module. The timings are grouped by end-point
+      and returned in C(_debug_info).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_METRICS) will be used instead.
+    type: bool
+  vcenter_rest_rate_burst:
+    default: 10
+    description:
+    - How many requests can be sent at once, before C(vcenter_rest_rate_limit) applies.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_BURST) will be used instead.
+    type: int
+  vcenter_rest_rate_limit:
+    default: 0
+    description:
+    - The maximum number of requests per second sent to the vCenter, C(0) means no
+      limit. In turbo mode, the limit is shared by all the modules that use the same
+      vCenter and the same limit.
+    - The time spent waiting is reported in C(_debug_info) when C(vcenter_rest_metrics)
+      is enabled.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_LIMIT) will be used instead.
+    type: float
+  vcenter_rest_read_timeout:
+    default: 60
+    description:
+    - How many seconds a GET request can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_READ_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_retries:
+    default: 3
+    description:
+    - How many times a request is sent again when vCenter sheds it (HTTP 429, 502,
+      503 or 504) or when the connection fails. The module waits longer after each
+      attempt, or as long as the C(Retry-After) header asks.
+    - The GET requests are always retried. The other requests are only retried when
+      vCenter cannot have processed them (HTTP 429, connection failure).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RETRIES) will be used instead.
+    type: int
+  vcenter_rest_task_timeout:
+    default: 3600
+    description:
+    - How many seconds a request that starts a vCenter task (e.g. a VM clone) can take,
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_TASK_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_write_timeout:
+    default: 300
+    description:
+    - How many seconds a request that changes something (POST, PATCH, PUT or DELETE)
+      can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_WRITE_TIMEOUT) will be used instead.
+    type: float
+  vcenter_username:
+    description:
+    - The vSphere vCenter username
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_USER) will be used instead.
+    required: true
+    type: str
+  vcenter_validate_certs:
+    default: true
+    description:
+    - Allows connection when SSL certificates are not valid. Set to C(false) when
+      certificates are not trusted.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_VALIDATE_CERTS) will be used instead.
+    type: bool
+  vm:
+    description:
+    - Virtual machine identifier.
+    required: true
+    type: str
+author:
+- Ansible Cloud Team (@ansible-collections)
+version_added: 1.1.0
+requirements:
+- python >= 3.6
+- aiohttp
+"""
+
+EXAMPLES = r"""
+- name: Converge the hardware of the VM
+  vmware.vmware_rest.vcenter_vm_hardware_reconcile:
+    vm: '{{ test_vm1_info.id }}'
+    cpu:
+      count: 2
+      hot_add_enabled: true
+    memory:
+      size_MiB: 2048
+    disks:
+    - label: Hard disk 2
+      type: SATA
+      new_vmdk:
+        capacity: 320000
+    nics:
+    - label: Network adapter 1
+      type: VMXNET3
+      backing:
+        type: STANDARD_PORTGROUP
+        network: '{{ my_portgroup_info.network }}'
+      start_connected: true
+"""
+
+RETURN = r"""
+value:
+  description: The changes applied to the virtual machine, one entry per device with
+    the C(operation) (C(create) or C(update)), the C(spec) sent to vCenter and whether
+    it has C(failed).
+  returned: On success
+  sample:
+  - changed: true
+    device: cpu
+    failed: false
+    operation: update
+    spec:
+      count: 2
+  - changed: true
+    device: disks
+    failed: false
+    id: '16001'
+    operation: create
+    spec:
+      new_vmdk:
+        capacity: 320000
+      type: SATA
+  type: list
+"""
+
+import asyncio
+from ansible.module_utils.basic import env_fallback
+
+try:
+    from ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions import (
+        EmbeddedModuleFailure,
+    )
+    from ansible_collections.cloud.common.plugins.module_utils.turbo.module import (
+        AnsibleTurboModule as AnsibleModule,
+    )
+
+    AnsibleModule.collection_name = "vmware.vmware_rest"
+except ImportError:
+    from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.vmware.vmware_rest.plugins.module_utils.vmware_rest import (
+    get_changes,
+    is_same,
+    merge_results,
+    open_session,
+    update_changed_flag,
+)
+
+# The settings of the VM, the key is the option of the module and the key
+# in the answer of /api/vcenter/vm/{vm}
+SETTINGS = {"boot": "boot", "cpu": "cpu", "memory": "memory"}
+# The devices of the VM: their end-point, the keys that vCenter can update
+# and the keys that identify a device.
+DEVICES = {
+    "cdroms": {
+        "path": "cdrom",
+        "update": ["allow_guest_control", "backing", "start_connected"],
+        "address": ["ide", "sata"],
+    },
+    "disks": {
+        "path": "disk",
+        "update": ["backing"],
+        "address": ["ide", "nvme", "sata", "scsi"],
+    },
+    "nics": {
+        "path": "ethernet",
+        "update": [
+            "allow_guest_control",
+            "backing",
+            "mac_address",
+            "mac_type",
+            "start_connected",
+            "upt_compatibility_enabled",
+            "wake_on_lan_enabled",
+        ],
+        "address": ["mac_address"],
+    },
+}
+
+
+def prepare_argument_spec():
+    argument_spec = {
+        "vcenter_hostname": dict(
+            type="str", required=True, fallback=(env_fallback, ["VMWARE_HOST"]),
+        ),
+        "vcenter_username": dict(
+            type="str", required=True, fallback=(env_fallback, ["VMWARE_USER"]),
+        ),
+        "vcenter_password": dict(
+            type="str",
+            required=True,
+            no_log=True,
+            fallback=(env_fallback, ["VMWARE_PASSWORD"]),
+        ),
+        "vcenter_validate_certs": dict(
+            type="bool",
+            required=False,
+            default=True,
+            fallback=(env_fallback, ["VMWARE_VALIDATE_CERTS"]),
+        ),
+        "vcenter_rest_log_file": dict(
+            type="str",
+            required=False,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_FILE"]),
+        ),
+        "vcenter_rest_concurrency": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONCURRENCY"]),
+        ),
+        "vcenter_rest_connection_limit": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECTION_LIMIT"]),
+        ),
+        "vcenter_rest_log_max_body_size": dict(
+            type="int",
+            required=False,
+            default=-1,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_BODY_SIZE"]),
+        ),
+        "vcenter_rest_log_max_file_size": dict(
+            type="int",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_FILE_SIZE"]),
+        ),
+        "vcenter_rest_metrics": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_METRICS"]),
+        ),
+        "vcenter_rest_cache": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_CACHE"]),
+        ),
+        "vcenter_rest_retries": dict(
+            type="int",
+            required=False,
+            default=3,
+            fallback=(env_fallback, ["VMWARE_REST_RETRIES"]),
+        ),
+        "vcenter_rest_rate_limit": dict(
+            type="float",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_LIMIT"]),
+        ),
+        "vcenter_rest_rate_burst": dict(
+            type="int",
+            required=False,
+            default=10,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_BURST"]),
+        ),
+        "vcenter_rest_connect_timeout": dict(
+            type="float",
+            required=False,
+            default=30,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECT_TIMEOUT"]),
+        ),
+        "vcenter_rest_read_timeout": dict(
+            type="float",
+            required=False,
+            default=60,
+            fallback=(env_fallback, ["VMWARE_REST_READ_TIMEOUT"]),
+        ),
+        "vcenter_rest_write_timeout": dict(
+            type="float",
+            required=False,
+            default=300,
+            fallback=(env_fallback, ["VMWARE_REST_WRITE_TIMEOUT"]),
+        ),
+        "vcenter_rest_task_timeout": dict(
+            type="float",
+            required=False,
+            default=3600,
+            fallback=(env_fallback, ["VMWARE_REST_TASK_TIMEOUT"]),
+        ),
+    }
+
+    argument_spec["boot"] = {"type": "dict"}
+    argument_spec["cdroms"] = {"type": "list", "elements": "dict"}
+    argument_spec["cpu"] = {"type": "dict"}
+    argument_spec["disks"] = {"type": "list", "elements": "dict"}
+    argument_spec["memory"] = {"type": "dict"}
+    argument_spec["nics"] = {"type": "list", "elements": "dict"}
+    argument_spec["vm"] = {"required": True, "type": "str"}
+
+    return argument_spec
+
+
+async def main():
+    required_if = list([])
+
+    module_args = prepare_argument_spec()
+    module = AnsibleModule(
+        argument_spec=module_args, required_if=required_if, supports_check_mode=True
+    )
+    if not module.params["vcenter_hostname"]:
+        module.fail_json("vcenter_hostname cannot be empty")
+    if not module.params["vcenter_username"]:
+        module.fail_json("vcenter_username cannot be empty")
+    if not module.params["vcenter_password"]:
+        module.fail_json("vcenter_password cannot be empty")
+    try:
+        session = await open_session(
+            vcenter_hostname=module.params["vcenter_hostname"],
+            vcenter_username=module.params["vcenter_username"],
+            vcenter_password=module.params["vcenter_password"],
+            validate_certs=module.params["vcenter_validate_certs"],
+            log_file=module.params["vcenter_rest_log_file"],
+            concurrency=module.params["vcenter_rest_concurrency"],
+            connection_limit=module.params["vcenter_rest_connection_limit"],
+            log_max_body_size=module.params["vcenter_rest_log_max_body_size"],
+            log_max_file_size=module.params["vcenter_rest_log_max_file_size"],
+            collect_metrics=module.params["vcenter_rest_metrics"],
+            cache=module.params["vcenter_rest_cache"],
+            retries=module.params["vcenter_rest_retries"],
+            rate_limit=module.params["vcenter_rest_rate_limit"],
+            rate_burst=module.params["vcenter_rest_rate_burst"],
+            connect_timeout=module.params["vcenter_rest_connect_timeout"],
+            read_timeout=module.params["vcenter_rest_read_timeout"],
+            write_timeout=module.params["vcenter_rest_write_timeout"],
+            task_timeout=module.params["vcenter_rest_task_timeout"],
+        )
+    except EmbeddedModuleFailure as err:
+        module.fail_json(err.get_message())
+    result = await entry_point(module, session)
+    module.exit_json(**result)
+
+
+def build_url(params):
+    return ("https://{vcenter_hostname}" "/api/vcenter/vm/{vm}").format(**params)
+
+
+class UnsupportedChange(Exception):
+    pass
+
+
+async def entry_point(module, session):
+    async with session.get(build_url(module.params)) as resp:
+        _json = await resp.json()
+        if resp.status != 200:
+            return await update_changed_flag(_json, resp.status, "get")
+        if "value" in _json:  # 7.0.2 <
+            _json = _json["value"]
+
+    try:
+        plan = get_plan(module.params, _json)
+    except UnsupportedChange as e:
+        return {"failed": True, "changed": False, "msg": str(e)}
+    if module.check_mode:
+        return {"value": plan, "changed": bool(plan)}
+
+    # vCenter rejects a reconfiguration while another one runs on the same
+    # VM (TaskInProgress) and two new devices would race for the same unit
+    # number of a controller.
+    results = []
+    for change in plan:
+        try:
+            results.append(await apply_change(module.params, session, change))
+        except (session.aiohttp.ClientError, asyncio.TimeoutError) as e:
+            results.append(dict(change, failed=True, msg=str(e) or repr(e)))
+    return merge_results(results)
+
+
+def match_devices(current, expected, address_keys):
+    """Pair the expected devices with the existing ones.
+
+    A spec only matches a device with the same label or, failing that, the
+    same address. The position is never used: a new disk must not take the
+    place of the OS disk.
+
+    Return a list of (device ID or None, expected spec).
+    """
+    available = sorted(current, key=lambda i: int(i) if i.isdigit() else i)
+
+    def _find(spec):
+        for _id in available:
+            if spec.get("label") and current[_id].get("label") == spec["label"]:
+                return _id
+        for _id in available:
+            if any(
+                spec.get(k) and is_same_address(current[_id].get(k), spec[k])
+                for k in address_keys
+            ):
+                return _id
+
+    pairs = []
+    for spec in expected:
+        match = _find(spec)
+        if match:
+            available.remove(match)
+        pairs.append((match, spec))
+    return pairs
+
+
+def is_same_address(current, expected):
+    """Tell if two addresses are the same, all their keys included.
+
+    e.g: {"bus": 0} is not the address of the disk {"bus": 0, "unit": 0}.
+    """
+    return is_same(current, expected) and is_same(expected, current)
+
+
+def get_plan(params, vm):
+    """Return the list of the changes that converge the VM hardware.
+
+    Raise UnsupportedChange if an existing device differs on a key that
+    vCenter cannot update, e.g. the type of a disk.
+    """
+    plan = []
+    for option, key in SETTINGS.items():
+        if params[option]:
+            spec = get_changes(vm.get(key), params[option])
+            if spec:
+                plan.append({"device": option, "operation": "update", "spec": spec})
+    for option, device_type in DEVICES.items():
+        current = vm.get(option) or {}
+        # 7.0.2 <, the devices come as a list of {"key": ID, "value": device}
+        if isinstance(current, list):
+            current = {i["key"]: i["value"] for i in current}
+        pairs = match_devices(current, params[option] or [], device_type["address"])
+        for _id, expected in pairs:
+            if _id is None:
+                spec = {k: v for k, v in expected.items() if k != "label"}
+                plan.append({"device": option, "operation": "create", "spec": spec})
+                continue
+            fixed = {
+                k: v
+                for k, v in expected.items()
+                if k not in device_type["update"] + ["label", "new_vmdk"]
+            }
+            unsupported = get_changes(current[_id], fixed)
+            if unsupported:
+                raise UnsupportedChange(
+                    "Cannot change {0} of the {1} {2}, remove the device first".format(
+                        ", ".join(sorted(unsupported)), option, _id
+                    )
+                )
+            updatable = {
+                k: v for k, v in expected.items() if k in device_type["update"]
+            }
+            spec = get_changes(current[_id], updatable)
+            if spec:
+                plan.append(
+                    {"device": option, "id": _id, "operation": "update", "spec": spec}
+                )
+    return plan
+
+
+async def apply_change(params, session, change):
+    if change["device"] in SETTINGS:
+        url = build_url(params) + "/hardware/" + change["device"]
+    else:
+        url = build_url(params) + "/hardware/" + DEVICES[change["device"]]["path"]
+    if change["operation"] == "create":
+        request = session.post(url, json=change["spec"])
+    else:
+        if change.get("id"):
+            url += "/" + change["id"]
+        request = session.patch(url, json=change["spec"])
+    async with request as resp:
+        try:
+            if resp.headers["Content-Type"] == "application/json":
+                _json = await resp.json()
+        except KeyError:
+            _json = {}
+        if "value" not in _json:  # 7.0.2
+            _json = {"value": _json}
+        _json = await update_changed_flag(_json, resp.status, change["operation"])
+    failed = _json.get("failed", False)
+    result = dict(change, changed=not failed, failed=failed)
+    if result["failed"]:
+        result["msg"] = _json["value"]
+    elif change["operation"] == "create":
+        result["id"] = _json["value"]
+    return result
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
@@ -14,6 +14,53 @@ module: vcenter_vm_power
 short_description: Resets a powered-on virtual machine.
 description: Resets a powered-on virtual machine.
 options:
+  clusters:
+    description:
+    - Clusters that must contain the virtual machine for the virtual machine to match
+      the filter.
+    elements: str
+    type: list
+  datacenters:
+    aliases:
+    - filter_datacenters
+    description:
+    - Datacenters that must contain the virtual machine for the virtual machine to
+      match the filter.
+    elements: str
+    type: list
+  folders:
+    aliases:
+    - filter_folders
+    description:
+    - Folders that must contain the virtual machine for the virtual machine to match
+      the filter.
+    elements: str
+    type: list
+  hosts:
+    description:
+    - Hosts that must contain the virtual machine for the virtual machine to match
+      the filter.
+    elements: str
+    type: list
+  names:
+    aliases:
+    - filter_names
+    description:
+    - Names that virtual machines must have to match the filter (see {@link Info#name}).
+    elements: str
+    type: list
+  power_states:
+    description:
+    - Power states that a virtual machine must be in to match the filter (see {@link
+      I(info)#state}.
+    elements: str
+    type: list
+  resource_pools:
+    description:
+    - Resource pools that must contain the virtual machine for the virtual machine
+      to match the filter.
+    elements: str
+    type: list
   state:
     choices:
     - reset
@@ -37,6 +84,42 @@ options:
       C(VMWARE_PASSWORD) will be used instead.
     required: true
     type: str
+  vcenter_rest_cache:
+    default: false
+    description:
+    - Keep the answers of the read-mostly end-points (datacenter, folder, datastore,
+      network, cluster and resource pool) in memory for a short time, and reuse them
+      in the following module calls. A write on one of these end-points drops its
+      cached answers.
+    - This is only useful with the C(cloud.common) turbo mode.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CACHE) will be used instead.
+    type: bool
+  vcenter_rest_concurrency:
+    default: 20
+    description:
+    - Maximum number of requests that run in parallel against the vCenter when
+      the module needs to fetch a list of resources.
+    - This budget is shared by all the modules that target the same vCenter.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONCURRENCY) will be used instead.
+    type: int
+  vcenter_rest_connect_timeout:
+    default: 30
+    description:
+    - How many seconds to wait for the connection with the vCenter (TCP and TLS),
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECT_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_connection_limit:
+    default: 20
+    description:
+    - Maximum number of simultaneous connections with the vCenter. Use C(0) to
+      remove the limit.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_CONNECTION_LIMIT) will be used instead.
+    type: int
   vcenter_rest_log_file:
     description:
     - 'You can use this optional parameter to set the location of a log file. '
@@ -45,6 +128,83 @@ options:
     - 'If the value is not specified in the task, the value of '
     - environment variable C(VMWARE_REST_LOG_FILE) will be used instead.
     type: str
+  vcenter_rest_log_max_body_size:
+    default: -1
+    description:
+    - Maximum number of bytes of each answer to record in the log file. Use C(0)
+      to skip the answers and C(-1) to record them in full.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_BODY_SIZE) will be used instead.
+    type: int
+  vcenter_rest_log_max_file_size:
+    default: 0
+    description:
+    - Size in MiB after which the log file is rotated. Use C(0) to disable the
+      rotation.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_LOG_MAX_FILE_SIZE) will be used instead.
+    type: int
+  vcenter_rest_metrics:
+    default: false
+    description:
+    - Record the duration of each phase (DNS, connection, time to first byte, total)
+      of the HTTP requests done by the module. The timings are grouped by end-point
+      and returned in C(_debug_info).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_METRICS) will be used instead.
+    type: bool
+  vcenter_rest_rate_burst:
+    default: 10
+    description:
+    - How many requests can be sent at once, before C(vcenter_rest_rate_limit) applies.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_BURST) will be used instead.
+    type: int
+  vcenter_rest_rate_limit:
+    default: 0
+    description:
+    - The maximum number of requests per second sent to the vCenter, C(0) means no
+      limit. In turbo mode, the limit is shared by all the modules that use the same
+      vCenter and the same limit.
+    - The time spent waiting is reported in C(_debug_info) when C(vcenter_rest_metrics)
+      is enabled.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RATE_LIMIT) will be used instead.
+    type: float
+  vcenter_rest_read_timeout:
+    default: 60
+    description:
+    - How many seconds a GET request can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_READ_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_retries:
+    default: 3
+    description:
+    - How many times a request is sent again when vCenter sheds it (HTTP 429, 502,
+      503 or 504) or when the connection fails. The module waits longer after each
+      attempt, or as long as the C(Retry-After) header asks.
+    - The GET requests are always retried. The other requests are only retried when
+      vCenter cannot have processed them (HTTP 429, connection failure).
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_RETRIES) will be used instead.
+    type: int
+  vcenter_rest_task_timeout:
+    default: 3600
+    description:
+    - How many seconds a request that starts a vCenter task (e.g. a VM clone) can take,
+      C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_TASK_TIMEOUT) will be used instead.
+    type: float
+  vcenter_rest_write_timeout:
+    default: 300
+    description:
+    - How many seconds a request that changes something (POST, PATCH, PUT or DELETE)
+      can take, C(0) means no timeout.
+    - If the value is not specified in the task, the value of environment variable
+      C(VMWARE_REST_WRITE_TIMEOUT) will be used instead.
+    type: float
   vcenter_username:
     description:
     - The vSphere vCenter username
@@ -62,9 +222,15 @@ options:
     type: bool
   vm:
     description:
-    - Virtual machine identifier. This parameter is mandatory.
-    required: true
+    - Virtual machine identifier. Required unless I(vms) or another filter is set.
     type: str
+  vms:
+    description:
+    - Identifiers of virtual machines that can match the filter.
+    - With I(vms) or any other filter, the power action is applied to all the matching
+      virtual machines, in parallel. The module returns one result per virtual machine.
+    elements: str
+    type: list
 author:
 - Ansible Cloud Team (@ansible-collections)
 version_added: 1.0.0
@@ -101,6 +267,14 @@ EXAMPLES = r"""
   vmware.vmware_rest.vcenter_vm_power:
     state: start
     vm: '{{ test_vm1_info.id }}'
+
+- name: Turn off all the VM of a folder
+  vmware.vmware_rest.vcenter_vm_power:
+    state: stop
+    folders:
+    - '{{ my_virtual_machine_folder.folder }}'
+    power_states:
+    - POWERED_ON
 """
 
 RETURN = r"""
@@ -137,18 +311,34 @@ try:
 except ImportError:
     from ansible.module_utils.basic import AnsibleModule
 from ansible_collections.vmware.vmware_rest.plugins.module_utils.vmware_rest import (
+    FetchError,
     build_full_device_list,
     exists,
     gen_args,
     get_device_info,
     get_subdevice_type,
     list_devices,
+    list_ids,
     open_session,
     prepare_payload,
+    run_for_each,
     update_changed_flag,
 )
 
 
+# The options that select the VMs of a bulk action, see vcenter_vm_info
+VM_FILTERS = [
+    "clusters",
+    "datacenters",
+    "folders",
+    "hosts",
+    "names",
+    "power_states",
+    "resource_pools",
+    "vms",
+]
+
+
 def prepare_argument_spec():
     argument_spec = {
         "vcenter_hostname": dict(
@@ -174,14 +364,112 @@ def prepare_argument_spec():
             required=False,
             fallback=(env_fallback, ["VMWARE_REST_LOG_FILE"]),
         ),
+        "vcenter_rest_concurrency": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONCURRENCY"]),
+        ),
+        "vcenter_rest_connection_limit": dict(
+            type="int",
+            required=False,
+            default=20,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECTION_LIMIT"]),
+        ),
+        "vcenter_rest_log_max_body_size": dict(
+            type="int",
+            required=False,
+            default=-1,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_BODY_SIZE"]),
+        ),
+        "vcenter_rest_log_max_file_size": dict(
+            type="int",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_LOG_MAX_FILE_SIZE"]),
+        ),
+        "vcenter_rest_metrics": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_METRICS"]),
+        ),
+        "vcenter_rest_cache": dict(
+            type="bool",
+            required=False,
+            default=False,
+            fallback=(env_fallback, ["VMWARE_REST_CACHE"]),
+        ),
+        "vcenter_rest_retries": dict(
+            type="int",
+            required=False,
+            default=3,
+            fallback=(env_fallback, ["VMWARE_REST_RETRIES"]),
+        ),
+        "vcenter_rest_rate_limit": dict(
+            type="float",
+            required=False,
+            default=0,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_LIMIT"]),
+        ),
+        "vcenter_rest_rate_burst": dict(
+            type="int",
+            required=False,
+            default=10,
+            fallback=(env_fallback, ["VMWARE_REST_RATE_BURST"]),
+        ),
+        "vcenter_rest_connect_timeout": dict(
+            type="float",
+            required=False,
+            default=30,
+            fallback=(env_fallback, ["VMWARE_REST_CONNECT_TIMEOUT"]),
+        ),
+        "vcenter_rest_read_timeout": dict(
+            type="float",
+            required=False,
+            default=60,
+            fallback=(env_fallback, ["VMWARE_REST_READ_TIMEOUT"]),
+        ),
+        "vcenter_rest_write_timeout": dict(
+            type="float",
+            required=False,
+            default=300,
+            fallback=(env_fallback, ["VMWARE_REST_WRITE_TIMEOUT"]),
+        ),
+        "vcenter_rest_task_timeout": dict(
+            type="float",
+            required=False,
+            default=3600,
+            fallback=(env_fallback, ["VMWARE_REST_TASK_TIMEOUT"]),
+        ),
     }
 
+    argument_spec["clusters"] = {"type": "list", "elements": "str"}
+    argument_spec["datacenters"] = {
+        "aliases": ["filter_datacenters"],
+        "type": "list",
+        "elements": "str",
+    }
+    argument_spec["folders"] = {
+        "aliases": ["filter_folders"],
+        "type": "list",
+        "elements": "str",
+    }
+    argument_spec["hosts"] = {"type": "list", "elements": "str"}
+    argument_spec["names"] = {
+        "aliases": ["filter_names"],
+        "type": "list",
+        "elements": "str",
+    }
+    argument_spec["power_states"] = {"type": "list", "elements": "str"}
+    argument_spec["resource_pools"] = {"type": "list", "elements": "str"}
     argument_spec["state"] = {
         "required": True,
         "type": "str",
         "choices": ["reset", "start", "stop", "suspend"],
     }
-    argument_spec["vm"] = {"required": True, "type": "str"}
+    argument_spec["vm"] = {"type": "str"}
+    argument_spec["vms"] = {"type": "list", "elements": "str"}
 
     return argument_spec
 
@@ -191,7 +479,11 @@ async def main():
 
     module_args = prepare_argument_spec()
     module = AnsibleModule(
-        argument_spec=module_args, required_if=required_if, supports_check_mode=True
+        argument_spec=module_args,
+        required_if=required_if,
+        required_one_of=[["vm"] + VM_FILTERS],
+        mutually_exclusive=[["vm", i] for i in VM_FILTERS],
+        supports_check_mode=True,
     )
     if not module.params["vcenter_hostname"]:
         module.fail_json("vcenter_hostname cannot be empty")
@@ -206,6 +498,19 @@ async def main():
             vcenter_password=module.params["vcenter_password"],
             validate_certs=module.params["vcenter_validate_certs"],
             log_file=module.params["vcenter_rest_log_file"],
+            concurrency=module.params["vcenter_rest_concurrency"],
+            connection_limit=module.params["vcenter_rest_connection_limit"],
+            log_max_body_size=module.params["vcenter_rest_log_max_body_size"],
+            log_max_file_size=module.params["vcenter_rest_log_max_file_size"],
+            collect_metrics=module.params["vcenter_rest_metrics"],
+            cache=module.params["vcenter_rest_cache"],
+            retries=module.params["vcenter_rest_retries"],
+            rate_limit=module.params["vcenter_rest_rate_limit"],
+            rate_burst=module.params["vcenter_rest_rate_burst"],
+            connect_timeout=module.params["vcenter_rest_connect_timeout"],
+            read_timeout=module.params["vcenter_rest_read_timeout"],
+            write_timeout=module.params["vcenter_rest_write_timeout"],
+            task_timeout=module.params["vcenter_rest_task_timeout"],
         )
     except EmbeddedModuleFailure as err:
         module.fail_json(err.get_message())
@@ -232,7 +537,22 @@ async def entry_point(module, session):
 
     func = globals()["_" + operation]
 
-    return await func(module.params, session)
+    if module.params["vm"]:
+        return await func(module.params, session)
+    return await _bulk(module.params, session, func)
+
+
+async def _bulk(params, session, func):
+    filters = {i: params[i] for i in VM_FILTERS if params[i]}
+    if list(filters) == ["vms"]:
+        vms = params["vms"]
+    else:
+        url = ("https://{vcenter_hostname}" "/api/vcenter/vm").format(**params)
+        try:
+            vms = await list_ids(session, url, filters, "vm")
+        except FetchError as e:
+            return {"failed": True, "msg": str(e)}
+    return await run_for_each(session, func, params, "vm", vms)
 
 
 async def _reset(params, session):
@@ -0,0 +1,19 @@
+import pytest
+
+from ansible_collections.vmware.vmware_rest.plugins.module_utils import vmware_rest
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state():
+    """The module_utils keep per-vCenter state for the whole process."""
+    for registry in [
+        vmware_rest.login._session_path,
+        vmware_rest.get_semaphore._semaphores,
+        vmware_rest.get_device_indexes._indexes,
+        vmware_rest.get_circuit_breaker._breakers,
+        vmware_rest.get_rate_limiter._limiters,
+        vmware_rest.open_session._pool,
+    ]:
+        registry.clear()
+    vmware_rest.response_cache._entries.clear()
+    yield
@@ -0,0 +1,950 @@
+import asyncio
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+import pytest
+
+from ansible_collections.vmware.vmware_rest.plugins.module_utils import vmware_rest
+from ansible_collections.cloud.common.plugins.module_utils.turbo.exceptions import (
+    EmbeddedModuleFailure,
+)
+
+from ansible_collections.vmware.vmware_rest.plugins.module_utils.vmware_rest import (
+    CIRCUIT_BREAKER_THRESHOLD,
+    AdaptiveConcurrency,
+    SESSION_MAX_IDLE,
+    CircuitBreaker,
+    FetchError,
+    RateLimiter,
+    ResponseCache,
+    build_timeouts,
+    close_in_background,
+    evict_sessions,
+    build_device_list,
+    exists,
+    fetch_all,
+    get_cache_family,
+    get_changes,
+    get_endpoint_template,
+    get_rate_limiter,
+    get_update_payload,
+    is_already_set,
+    is_same,
+    list_ids,
+    login,
+    list_partitioned,
+    retry_delay,
+    run_for_each,
+    wait_for_task,
+    wait_until,
+)
+from ansible_collections.vmware.vmware_rest.tests.unit.utils import (
+    build_session,
+    run,
+)
+
+
+@pytest.mark.parametrize(
+    "current,desired",
+    [
+        ({"a": 1, "b": 2}, {"a": 1}),
+        ({"a": 1}, {"a": None}),
+        (2, "2"),
+        (2.0, 2),
+        (True, "true"),
+        (False, "False"),
+        ("00:50:56:AA:BB:CC", "00:50:56:aa:bb:cc"),
+        ([1, 2, 3], [3, 2, 1]),
+        ({"a": {"b": {"c": 1, "d": 2}}}, {"a": {"b": {"c": 1}}}),
+        ([{"key": "k1", "value": {"a": 1}}], {"k1": {"a": 1}}),
+    ],
+)
+def test_is_same(current, desired):
+    assert is_same(current, desired)
+
+
+@pytest.mark.parametrize(
+    "current,desired",
+    [
+        ({"a": 1}, {"a": 2}),
+        ({}, {"a": 1}),
+        ("123", "0123"),
+        ("1.0", "1"),
+        ("True", "true"),
+        (1, True),
+        (True, "1"),
+        ([1, 2], [1, 2, 3]),
+        ({"devices": [1, 2]}, {"devices": [2, 1]}),
+    ],
+)
+def test_is_not_same(current, desired):
+    assert not is_same(current, desired)
+
+
+def test_get_changes():
+    current = {
+        "name": "vm1",
+        "cpu": {"count": 1, "hot_add_enabled": False},
+        "backing": {"type": "VMDK_FILE", "vmdk_file": "[ds] a.vmdk"},
+    }
+    desired = {
+        "name": "vm1",
+        "cpu": {"count": "2", "hot_add_enabled": "false"},
+        "backing": {"type": "VMDK_FILE", "vmdk_file": "[ds] b.vmdk"},
+    }
+    assert get_changes(current, desired) == {
+        "cpu": {"count": "2"},
+        "backing": {"type": "VMDK_FILE", "vmdk_file": "[ds] b.vmdk"},
+    }
+
+
+def test_get_changes_list():
+    current = {"servers": ["10.0.0.1", "10.0.0.2"]}
+    desired = {"servers": ["10.0.0.2", "10.0.0.1"]}
+    assert get_changes(current, desired) == desired
+
+
+def test_get_update_payload():
+    current = {"name": "folder1", "cpu_count": 2, "memory_size_MiB": 1024}
+    payload = {
+        "name": "folder1",
+        "spec": {"cpu_count": 2, "memory_size_MiB": 2048},
+    }
+    assert get_update_payload(current, payload) == {"spec": {"memory_size_MiB": 2048}}
+
+
+def test_get_update_payload_no_change():
+    current = {"name": "0123"}
+    assert get_update_payload(current, {"name": "0123"}) == {}
+    assert get_update_payload(current, {"name": "123"}) == {"name": "123"}
+
+
+@pytest.mark.parametrize(
+    "current,payload,expected",
+    [
+        ({"mode": "NTP", "servers": ["a", "b"]}, {"mode": "NTP"}, True),
+        ({"value": {"mode": "NTP"}}, {"mode": "NTP"}, True),
+        ({"mode": "NTP"}, {"mode": "HOST"}, False),
+        ("host1", {"name": "host1"}, True),
+        ("host1", {"name": "host2"}, False),
+        ({"value": "0123"}, {"name": "123"}, False),
+        ({"mode": "NTP"}, {}, False),
+    ],
+)
+def test_is_already_set(current, payload, expected):
+    assert is_already_set(current, payload) is expected
+
+
+class FakePooledSession:
+    def __init__(self, idle_time=0, in_flight=0, last_used=0, close=None):
+        self.idle_time = idle_time
+        self.in_flight = in_flight
+        self.last_used = last_used
+        self.closed = False
+        self._close = close
+
+    async def close(self):
+        if self._close:
+            await self._close()
+        self.closed = True
+
+
+def test_evict_sessions_does_not_wait_for_the_close():
+    async def _test():
+        vcenter_down = asyncio.Event()
+        idle = FakePooledSession(
+            idle_time=SESSION_MAX_IDLE + 1, close=vcenter_down.wait
+        )
+        old = FakePooledSession(last_used=1)
+        pool = {
+            "idle": idle,
+            "old": old,
+            "recent": FakePooledSession(last_used=2),
+            "busy": FakePooledSession(in_flight=1),
+        }
+        evict_sessions(pool, max_size=3)
+        assert sorted(pool) == ["busy", "recent"]
+        await asyncio.sleep(0)
+        assert old.closed
+        assert not idle.closed
+        vcenter_down.set()
+        await asyncio.gather(*close_in_background._tasks)
+        assert idle.closed
+
+    run(_test())
+
+
+def test_close_after_a_timeout():
+    def handler(method, url, **kwargs):
+        raise asyncio.TimeoutError()
+
+    session = build_session(handler)
+    run(session.close())
+    assert session.client_session.requests == [
+        ("DELETE", "https://vcenter.test/rest/com/vmware/cis/session")
+    ]
+    assert session.client_session.closed
+
+
+def test_close_after_a_connection_error():
+    def handler(method, url, **kwargs):
+        raise aiohttp.ServerDisconnectedError()
+
+    session = build_session(handler)
+    run(session.close())
+    assert session.client_session.closed
+
+
+DISK_URL = "https://vcenter.test/api/vcenter/vm/vm-1/hardware/disk"
+
+
+def disk_handler(disks, errors=None):
+    """Answer like the disk end-points of a VM with the disks by ID."""
+
+    def handler(method, url, **kwargs):
+        if url == DISK_URL:
+            return 200, [{"disk": i} for i in disks]
+        _id = url.split("/")[-1]
+        if _id in (errors or []):
+            return 403, {"error_type": "UNAUTHORIZED"}
+        return 200, disks[_id]
+
+    return handler
+
+
+def test_exists_fails_if_a_device_cannot_be_read():
+    disks = {"2000": {"label": "Hard disk 1"}, "2001": {"label": "Hard disk 2"}}
+    session = build_session(disk_handler(disks, errors=["2001"]))
+    with pytest.raises(EmbeddedModuleFailure) as e:
+        run(exists({"label": "Hard disk 2"}, session, DISK_URL))
+    assert "2001" in e.value.get_message()
+    assert not session.indexes
+
+
+def test_exists_fails_if_the_matched_resource_cannot_be_read():
+    vm_url = "https://vcenter.test/api/vcenter/vm"
+
+    def handler(method, url, **kwargs):
+        if url.startswith(vm_url + "?"):
+            return 200, [{"vm": "vm-1", "name": "vm1"}]
+        return 403, {"error_type": "UNAUTHORIZED"}
+
+    session = build_session(handler)
+    with pytest.raises(EmbeddedModuleFailure) as e:
+        run(exists({"name": "vm1"}, session, vm_url, ["vm"], list_query=["names"]))
+    assert "vm-1" in e.value.get_message()
+    assert session.client_session.requests == [
+        ("GET", vm_url + "?names=vm1"),
+        ("GET", vm_url + "/vm-1"),
+    ]
+
+
+def test_exists_fetches_the_indexed_device_again():
+    disks = {"2000": {"label": "Hard disk 1", "capacity": 1024}}
+    session = build_session(disk_handler(disks))
+    assert run(exists({"label": "Hard disk 1"}, session, DISK_URL))["id"] == "2000"
+    disks["2000"]["capacity"] = 2048
+    device = run(exists({"label": "Hard disk 1"}, session, DISK_URL))
+    assert device["value"]["capacity"] == 2048
+    assert session.client_session.requests[2:] == [("GET", DISK_URL + "/2000")]
+
+
+def test_exists_rebuilds_a_stale_index():
+    disks = {"2000": {"label": "Hard disk 1"}, "2001": {"label": "Hard disk 2"}}
+    session = build_session(disk_handler(disks))
+    assert run(exists({"label": "Hard disk 2"}, session, DISK_URL))["id"] == "2001"
+    disks["2000"]["label"], disks["2001"]["label"] = "Hard disk 2", "Hard disk 1"
+    assert run(exists({"label": "Hard disk 2"}, session, DISK_URL))["id"] == "2000"
+    assert run(exists({"label": "Hard disk 3"}, session, DISK_URL)) is None
+
+
+def test_build_timeouts():
+    timeouts = build_timeouts(aiohttp, 30, 60, 0, 3600)
+    assert timeouts["read"].total == 60
+    assert timeouts["write"].total is None
+    assert timeouts["task"].total == 3600
+    for timeout in timeouts.values():
+        # The wait for a connection of the pool is not a connect timeout
+        assert timeout.connect is None
+        assert timeout.sock_connect == 30
+
+
+@pytest.mark.parametrize(
+    "method,url,expected",
+    [
+        ("GET", "https://vcenter.test/api/vcenter/vm", "read"),
+        ("POST", "https://vcenter.test/api/vcenter/vm", "write"),
+        (
+            "POST",
+            "https://vcenter.test/api/vcenter/vm?action=clone&vmw-task=true",
+            "task",
+        ),
+    ],
+)
+def test_get_timeout(method, url, expected):
+    timeouts = build_timeouts(aiohttp, 30, 60, 300, 3600)
+    session = build_session(None, timeouts=timeouts)
+    assert session.get_timeout(method, url) is timeouts[expected]
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker("vcenter.test", threshold=2, cooldown=30)
+    breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(EmbeddedModuleFailure):
+        breaker.check()
+    # After the cooldown, a single request is let through
+    breaker.opened_at -= 30
+    breaker.check(trial=False)
+    breaker.check()
+    with pytest.raises(EmbeddedModuleFailure):
+        breaker.check()
+    breaker.record_success()
+    breaker.check()
+    assert breaker.failures == 0
+
+
+def test_circuit_breaker_opens_again_after_a_failed_trial():
+    breaker = CircuitBreaker("vcenter.test", threshold=1, cooldown=30)
+    breaker.record_failure()
+    breaker.opened_at -= 30
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(EmbeddedModuleFailure):
+        breaker.check()
+
+
+@pytest.mark.parametrize(
+    "error,failures",
+    [
+        (aiohttp.ServerDisconnectedError(), 1),
+        (aiohttp.ServerTimeoutError(), 1),
+        # The total timeout includes the wait for a connection of the pool
+        (asyncio.TimeoutError(), 0),
+        (aiohttp.ClientPayloadError(), 0),
+    ],
+)
+def test_circuit_breaker_failures(error, failures):
+    def handler(method, url, **kwargs):
+        raise error
+
+    session = build_session(handler)
+    with pytest.raises(type(error)):
+        run(session.request("GET", "https://vcenter.test/api/vcenter/vm"))
+    assert session.circuit_breaker.failures == failures
+
+
+@pytest.mark.parametrize(
+    "error,failures",
+    [
+        (aiohttp.ServerDisconnectedError(), 1),
+        (aiohttp.ServerTimeoutError(), 1),
+        (asyncio.TimeoutError(), 0),
+    ],
+)
+def test_circuit_breaker_login_failures(error, failures):
+    def handler(method, url, **kwargs):
+        raise error
+
+    session = build_session(handler)
+    with pytest.raises(EmbeddedModuleFailure):
+        run(login(aiohttp, session.client_session, "vcenter.test", session.auth))
+    assert session.circuit_breaker.failures == failures
+
+
+def test_circuit_breaker_opens_on_the_server_errors():
+    statuses = [503] * CIRCUIT_BREAKER_THRESHOLD
+
+    def handler(method, url, **kwargs):
+        return statuses.pop(0), {}
+
+    session = build_session(handler)
+    for _ in range(CIRCUIT_BREAKER_THRESHOLD):
+        resp = run(session.request("GET", "https://vcenter.test/api/vcenter/vm"))
+        assert resp.status == 503
+    with pytest.raises(EmbeddedModuleFailure):
+        run(session.request("GET", "https://vcenter.test/api/vcenter/vm"))
+    assert not statuses
+
+
+@pytest.mark.parametrize(
+    "path,query,expected",
+    [
+        (
+            "/api/vcenter/vm/vm-1072/hardware/disk/2000",
+            None,
+            "/api/vcenter/vm/{vm}/hardware/disk/{disk}",
+        ),
+        ("/api/vcenter/cluster/domain-c8", None, "/api/vcenter/cluster/{cluster}"),
+        (
+            "/api/content/library/item/0a7f0b2c-1f2e-4d3c-9b8a-7c6d5e4f3a2b",
+            None,
+            "/api/content/library/item/{item}",
+        ),
+        (
+            "/api/cis/tasks/52b1e6f5-1b5a-aa7c-0d4b-8f3a0b4e2c1a:com.vmware.vcenter.vm",
+            None,
+            "/api/cis/tasks/{tasks}",
+        ),
+        (
+            "/api/cis/tasks/52b1e6f5-1b5a-aa7c-0d4b-8f3a0b4e2c1a%3Acom.vmware.vcenter.vm",
+            None,
+            "/api/cis/tasks/{tasks}",
+        ),
+        (
+            "/api/appliance/networking/interfaces/nic0/ipv4",
+            None,
+            "/api/appliance/networking/interfaces/nic0/ipv4",
+        ),
+        (
+            "/api/vcenter/vm/vm-1",
+            {"action": "clone"},
+            "/api/vcenter/vm/{vm}?action=clone",
+        ),
+    ],
+)
+def test_get_endpoint_template(path, query, expected):
+    assert get_endpoint_template(path, query) == expected
+
+
+@pytest.fixture
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(vmware_rest, "RETRY_DELAY", 0)
+
+
+def build_answers(*answers):
+    """Return a handler that gives the answers in order, and raises the errors."""
+    answers = list(answers)
+
+    def handler(method, url, **kwargs):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    return handler
+
+
+@pytest.mark.parametrize(
+    "method,answers,status,attempts",
+    [
+        ("GET", [(503, {}), (502, {}), (200, {})], 200, 3),
+        ("GET", [(503, {}), (503, {}), (503, {}), (503, {})], 503, 4),
+        ("GET", [(404, {})], 404, 1),
+        ("POST", [(503, {})], 503, 1),
+        ("POST", [(429, {}), (201, {})], 201, 2),
+        ("GET", [aiohttp.ServerDisconnectedError(), (200, {})], 200, 2),
+        ("GET", [asyncio.TimeoutError(), (200, {})], 200, 2),
+        ("POST", [aiohttp.ClientConnectorError(None, OSError()), (201, {})], 201, 2),
+    ],
+)
+def test_retries(no_retry_delay, method, answers, status, attempts):
+    session = build_session(build_answers(*answers), retries=3)
+    resp = run(session.request(method, "https://vcenter.test/api/vcenter/vm"))
+    assert resp.status == status
+    assert len(session.client_session.requests) == attempts
+
+
+@pytest.mark.parametrize(
+    "error", [aiohttp.ServerDisconnectedError(), asyncio.TimeoutError()]
+)
+def test_no_retry_of_a_change_that_may_have_been_applied(no_retry_delay, error):
+    session = build_session(build_answers(error), retries=3)
+    with pytest.raises(type(error)):
+        run(session.request("POST", "https://vcenter.test/api/vcenter/vm"))
+    assert len(session.client_session.requests) == 1
+
+
+def test_retry_delay():
+    for attempt in range(10):
+        delay = min(vmware_rest.RETRY_DELAY * 2 ** attempt, vmware_rest.RETRY_MAX_DELAY)
+        assert delay / 2 <= retry_delay(attempt) <= delay
+    assert retry_delay(0, "7") == 7
+    assert retry_delay(0, "3600") == vmware_rest.RETRY_MAX_DELAY
+    assert retry_delay(0, "Thu, 01 Jan 1970 00:00:00 GMT") == 0
+    assert retry_delay(0, "soon") <= vmware_rest.RETRY_DELAY
+
+
+def test_rate_limiter():
+    async def _test():
+        limiter = RateLimiter(rate=50, burst=2)
+        waited = [await limiter.acquire() for i in range(4)]
+        assert waited[:2] == [pytest.approx(0, abs=0.005)] * 2
+        # The next tokens come every 1 / rate seconds
+        assert sum(waited[2:]) >= 0.035
+
+    run(_test())
+
+
+def test_get_rate_limiter():
+    assert get_rate_limiter("vcenter.test", 0, 10) is None
+    limiter = get_rate_limiter("vcenter.test", 5, 10)
+    assert get_rate_limiter("vcenter.test", 5, 10) is limiter
+    assert get_rate_limiter("vcenter2.test", 5, 10) is not limiter
+
+
+def test_rate_limited_session():
+    contexts = []
+
+    def handler(method, url, **kwargs):
+        contexts.append(kwargs["trace_request_ctx"])
+        return 200, {}
+
+    async def _test():
+        session = build_session(handler, rate_limiter=RateLimiter(rate=50, burst=1))
+        for i in range(2):
+            await session.request("POST", "https://vcenter.test/api/vcenter/vm")
+
+    run(_test())
+    assert contexts[0]["queue"] < 0.005
+    assert contexts[1]["queue"] >= 0.015
+
+
+@pytest.mark.parametrize(
+    "url,expected",
+    [
+        ("https://vcenter.test/api/vcenter/datacenter", ("vcenter/datacenter", 300)),
+        (
+            "https://vcenter.test/api/vcenter/folder?type=VIRTUAL_MACHINE",
+            ("vcenter/folder", 60),
+        ),
+        (
+            "https://vcenter.test/rest/vcenter/datastore/datastore-1",
+            ("vcenter/datastore", 60),
+        ),
+        ("https://vcenter.test/api/vcenter/datastore-cluster", (None, 0)),
+        ("https://vcenter.test/api/vcenter/vm", (None, 0)),
+    ],
+)
+def test_get_cache_family(url, expected):
+    assert get_cache_family(url) == expected
+
+
+def test_response_cache():
+    cache = ResponseCache(max_size=2)
+    cache.set("a", "vcenter/folder", 60, "answer a")
+    cache.set("b", "vcenter/network", 60, "answer b")
+    cache.set("c", "vcenter/folder", -1, "answer c")
+    assert cache.get("a") is None  # The least recently used
+    assert cache.get("b") == "answer b"
+    assert cache.get("c") is None  # Expired
+    cache.set("d", "vcenter/folder", 60, "answer d")
+    cache.invalidate("vcenter/folder")
+    assert cache.get("d") is None
+    assert cache.get("b") == "answer b"
+
+
+def test_cached_session():
+    def handler(method, url, **kwargs):
+        return 200, [{"folder": "group-v4"}]
+
+    url = "https://vcenter.test/api/vcenter/folder"
+    session = build_session(handler, cache=True, digest="digest")
+    other = build_session(handler, cache=True, digest="other digest")
+    no_cache = build_session(handler, digest="digest")
+
+    async def _test():
+        for i in range(2):
+            async with session.get(url) as resp:
+                assert await resp.json() == [{"folder": "group-v4"}]
+        assert len(session.client_session.requests) == 1
+        await other.get(url)
+        assert len(other.client_session.requests) == 1
+        await no_cache.get(url)
+        await no_cache.get(url)
+        assert len(no_cache.client_session.requests) == 2
+        # A write drops the cached answers of the end-point
+        await session.post(url, json={"name": "new"})
+        await session.get(url)
+        assert session.client_session.requests[1:] == [("POST", url), ("GET", url)]
+
+    run(_test())
+
+
+def test_errors_are_not_cached():
+    session = build_session(build_answers((503, {}), (200, [])), cache=True)
+    url = "https://vcenter.test/api/vcenter/folder"
+    assert run(session.request("GET", url)).status == 503
+    assert run(session.request("GET", url)).status == 200
+
+
+def test_coalesced_gets():
+    async def _test():
+        answer = asyncio.Event()
+
+        async def handler(method, url, **kwargs):
+            await answer.wait()
+            return 200, {"name": "vm1"}
+
+        session = build_session(handler)
+        url = "https://vcenter.test/api/vcenter/vm/vm-1"
+        first = asyncio.ensure_future(session.request("GET", url))
+        second = asyncio.ensure_future(session.request("GET", url))
+        third = asyncio.ensure_future(session.request("GET", url))
+        other = asyncio.ensure_future(session.request("GET", url + "/hardware"))
+        await asyncio.sleep(0)
+        # A cancelled caller does not cancel the request of the others
+        first.cancel()
+        answer.set()
+        responses = await asyncio.gather(second, third, other)
+        assert [await i.json() for i in responses[:2]] == [{"name": "vm1"}] * 2
+        assert session.client_session.requests == [
+            ("GET", url),
+            ("GET", url + "/hardware"),
+        ]
+        assert not session.pending_gets
+        # Once answered, the next GET is a new request
+        await session.request("GET", url)
+        assert len(session.client_session.requests) == 3
+
+    run(_test())
+
+
+def test_gets_with_parameters_are_not_coalesced():
+    async def _test():
+        session = build_session(lambda method, url, **kwargs: (200, {}))
+        url = "https://vcenter.test/api/vcenter/vm"
+        await asyncio.gather(
+            session.request("GET", url, params={"names": "vm1"}),
+            session.request("GET", url, params={"names": "vm1"}),
+        )
+        assert len(session.client_session.requests) == 2
+
+    run(_test())
+
+
+def test_fetch_all(monkeypatch):
+    monkeypatch.setattr(vmware_rest, "FETCH_RETRY_DELAY", 0)
+    attempts = {}
+    running = []
+
+    async def func(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        running.append(item)
+        await asyncio.sleep(0.001)
+        assert len(running) <= 2
+        running.remove(item)
+        if item == "flaky" and attempts[item] < 2:
+            raise FetchError("try again", retry=True)
+        if item == "broken":
+            raise FetchError("broken", retry=True)
+        if item == "missing":
+            raise FetchError("not found")
+        if item == "disconnected":
+            raise aiohttp.ServerDisconnectedError()
+        return item.upper()
+
+    items = ["a", "flaky", "broken", "missing", "disconnected", "b"]
+    failures = []
+    session = build_session(None, concurrency=2)
+    results = run(fetch_all(session, func, items, failures))
+    assert results == ["A", "FLAKY", None, None, None, "B"]
+    assert attempts == {
+        "a": 1,
+        "flaky": 2,
+        "broken": vmware_rest.FETCH_RETRIES + 1,
+        "missing": 1,
+        "disconnected": 1,
+        "b": 1,
+    }
+    assert sorted(i["item"] for i in failures) == ["broken", "disconnected", "missing"]
+
+
+def test_build_device_list_reports_the_failures():
+    vm_url = "https://vcenter.test/api/vcenter/vm"
+
+    def handler(method, url, **kwargs):
+        if url.endswith("vm-2"):
+            return 403, {"error_type": "UNAUTHORIZED"}
+        return 200, {"name": url.split("-")[-1]}
+
+    session = build_session(handler)
+    _json = {"value": [{"vm": "vm-1"}, {"vm": "vm-2"}, {"vm": "vm-3"}]}
+    result = run(build_device_list(session, vm_url, _json, "vm"))
+    assert result["value"] == [{"vm": "vm-1", "name": "1"}, {"vm": "vm-3", "name": "3"}]
+    assert [i["id"] for i in result["failures"]] == ["vm-2"]
+
+
+class PartitionedVCenter:
+    """Refuse the VM lists of more than two entries.
+
+    dc-1 has h1 (vm-1 and vm-2) and h2 (vm-2, during a migration, and
+    vm-3), dc-2 has h3 (vm-4).
+    """
+
+    HOSTS = {"dc-1": ["h1", "h2"], "dc-2": ["h3"]}
+    VMS = {"h1": ["vm-1", "vm-2"], "h2": ["vm-2", "vm-3"], "h3": ["vm-4"]}
+
+    def __call__(self, method, url, **kwargs):
+        url = urlparse(url)
+        query = parse_qs(url.query)
+        if url.path == "/api/vcenter/datacenter":
+            return 200, [{"datacenter": i} for i in self.HOSTS]
+        hosts = [
+            h
+            for dc in query.get("datacenters", self.HOSTS)
+            for h in self.HOSTS[dc]
+            if h in query.get("hosts", [h])
+        ]
+        if url.path == "/api/vcenter/host":
+            return 200, [{"host": i} for i in hosts]
+        vms = sorted(set(vm for h in hosts for vm in self.VMS[h]))
+        if len(vms) > 2:
+            return 400, {"error_type": "UNABLE_TO_ALLOCATE_RESOURCE"}
+        return 200, [{"vm": i, "power_state": query["power_states"][0]} for i in vms]
+
+
+def test_list_partitioned():
+    session = build_session(PartitionedVCenter())
+    url = "https://vcenter.test/api/vcenter/vm?power_states=POWERED_ON"
+    _json, status = run(list_partitioned(session, url, "vm"))
+    assert status == 200
+    assert sorted(i["vm"] for i in _json["value"]) == ["vm-1", "vm-2", "vm-3", "vm-4"]
+    assert set(i["power_state"] for i in _json["value"]) == {"POWERED_ON"}
+    # dc-2 is small enough, it is not split by host
+    assert ("GET", "https://vcenter.test/api/vcenter/host?datacenters=dc-2") not in (
+        session.client_session.requests
+    )
+
+
+def test_list_partitioned_without_partition_filter():
+    def handler(method, url, **kwargs):
+        return 400, {"error_type": "UNABLE_TO_ALLOCATE_RESOURCE"}
+
+    session = build_session(handler)
+    url = "https://vcenter.test/api/vcenter/datastore-cluster"
+    _json, status = run(list_partitioned(session, url, "datastore_cluster"))
+    assert status == 400
+    assert len(session.client_session.requests) == 1
+
+
+def test_session_splits_the_refused_lists():
+    async def _test(session):
+        url = "https://vcenter.test/api/vcenter/vm?power_states=POWERED_ON"
+        async with session.get(url) as resp:
+            return resp.status, await resp.json()
+
+    session = build_session(PartitionedVCenter())
+    status, _json = run(_test(session))
+    assert status == 200
+    assert sorted(i["vm"] for i in _json) == ["vm-1", "vm-2", "vm-3", "vm-4"]
+
+
+def test_adaptive_concurrency_grows():
+    async def _test():
+        limiter = AdaptiveConcurrency(4)
+        assert limiter.limit == 2
+        for i in range(5):
+            await limiter.release(await limiter.acquire(), latency=1.0)
+        assert limiter.limit == 4
+        assert limiter.highest == 4
+
+    run(_test())
+
+
+def test_adaptive_concurrency_decreases_once_per_generation():
+    async def _test():
+        limiter = AdaptiveConcurrency(8, initial=8)
+        await limiter.release(await limiter.acquire(), latency=1.0)
+        tokens = [await limiter.acquire() for i in range(3)]
+        # Slower than tolerance times the lowest latency
+        await limiter.release(tokens[0], latency=2.5)
+        assert limiter.limit == 4
+        # Sent with the former limit, they don't decrease it again
+        await limiter.release(tokens[1], overloaded=True)
+        await limiter.release(tokens[2], latency=3.0)
+        assert limiter.limit == 4
+        await limiter.release(await limiter.acquire(), overloaded=True)
+        assert limiter.limit == 2
+        assert limiter.highest == 8
+
+    run(_test())
+
+
+def test_adaptive_concurrency_waits_for_a_slot():
+    async def _test():
+        limiter = AdaptiveConcurrency(1)
+        token = await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.001)
+        assert not waiting.done()
+        await limiter.release(token)
+        await asyncio.wait_for(waiting, 1)
+        assert limiter.in_flight == 1
+
+    run(_test())
+
+
+@pytest.fixture
+def no_task_poll_delay(monkeypatch):
+    monkeypatch.setattr(vmware_rest, "TASK_POLL_DELAY", 0)
+
+
+TASK_ID = "52b1e6f5-1b5a-aa7c-0d4b-8f3a0b4e2c1a:com.vmware.vcenter.vm"
+
+
+def test_wait_for_task(no_task_poll_delay):
+    session = build_session(
+        build_answers(
+            (200, {"status": "RUNNING", "progress": {"completed": 10}}),
+            (200, {"status": "RUNNING", "progress": {"completed": 10}}),
+            (200, {"status": "RUNNING", "progress": {"completed": 50}}),
+            (200, {"status": "SUCCEEDED", "result": "vm-1049"}),
+        )
+    )
+    result = run(wait_for_task(session, "vcenter.test", {"value": TASK_ID}))
+    assert result["value"] == "vm-1049"
+    assert result["changed"] and not result["failed"]
+    assert result["task"]["id"] == TASK_ID
+    assert result["task"]["progress"] == [{"completed": 10}, {"completed": 50}]
+    assert session.client_session.requests[0] == (
+        "GET",
+        "https://vcenter.test/api/cis/tasks/" + TASK_ID,
+    )
+
+
+def test_wait_for_a_failed_task(no_task_poll_delay):
+    error = {"messages": [{"default_message": "Not enough space"}]}
+    session = build_session(build_answers((200, {"status": "FAILED", "error": error})))
+    result = run(wait_for_task(session, "vcenter.test", {"value": TASK_ID}))
+    assert result["failed"] and not result["changed"]
+    assert result["value"] == error
+
+
+def test_wait_for_task_timeout(no_task_poll_delay):
+    session = build_session(
+        lambda method, url, **kwargs: (200, {"status": "RUNNING"}),
+        timeouts={"task": aiohttp.ClientTimeout(total=0.01)},
+    )
+    result = run(wait_for_task(session, "vcenter.test", {"value": TASK_ID}))
+    assert result["failed"]
+    assert "still RUNNING" in result["msg"]
+
+
+def test_wait_for_a_task_that_cannot_be_read(no_task_poll_delay):
+    session = build_session(build_answers((404, {"error_type": "NOT_FOUND"})))
+    result = run(wait_for_task(session, "vcenter.test", {"value": TASK_ID}))
+    assert result["failed"]
+    assert result["value"] == TASK_ID
+
+
+@pytest.fixture
+def no_wait_poll_delay(monkeypatch):
+    monkeypatch.setattr(vmware_rest, "WAIT_POLL_DELAY", 0)
+
+
+def build_func(*results):
+    results = list(results)
+
+    async def func():
+        return dict(results.pop(0) if len(results) > 1 else results[0])
+
+    return func
+
+
+def test_wait_until(no_wait_poll_delay):
+    func = build_func(
+        {"failed": True, "msg": "Not found"},
+        {"value": {"power_state": "POWERED_OFF"}},
+        {"value": {"power_state": "POWERED_ON"}},
+    )
+    result = run(wait_until(func, "power_state == 'POWERED_ON'"))
+    assert result["value"] == {"power_state": "POWERED_ON"}
+    assert result["_debug_info"]["wait_for"] == {"attempts": 3}
+
+
+def test_wait_until_timeout(no_wait_poll_delay):
+    func = build_func({"value": {"power_state": "POWERED_OFF"}})
+    result = run(wait_until(func, "power_state == 'POWERED_ON'", timeout=0.01))
+    assert result["failed"]
+    assert "still false" in result["msg"]
+
+
+def test_wait_until_without_condition():
+    func = build_func({"value": {"power_state": "POWERED_OFF"}})
+    assert run(wait_until(func)) == {"value": {"power_state": "POWERED_OFF"}}
+
+
+def test_wait_until_invalid_condition():
+    func = build_func({"value": {}})
+    result = run(wait_until(func, "power_state =="))
+    assert result["failed"]
+    assert "Invalid wait_for condition" in result["msg"]
+
+
+def test_list_ids():
+    vm_url = "https://vcenter.test/api/vcenter/vm"
+    session = build_session(
+        build_answers((200, [{"vm": "vm-1"}, {"vm": "vm-2"}]), (200, {"value": []}))
+    )
+    filters = {"names": ["vm1", "vm2"], "power_states": None}
+    assert run(list_ids(session, vm_url, filters, "vm")) == ["vm-1", "vm-2"]
+    assert session.client_session.requests == [("GET", vm_url + "?names=vm1&names=vm2")]
+    assert run(list_ids(session, vm_url, {}, "vm")) == []
+
+
+def test_list_ids_too_many_results():
+    vm_url = "https://vcenter.test/api/vcenter/vm"
+    too_many = (400, {"error_type": "UNABLE_TO_ALLOCATE_RESOURCE"})
+    # Still too many once split by datacenter and by host
+    session = build_session(
+        build_answers(
+            too_many,
+            (200, [{"datacenter": "dc-1"}]),
+            too_many,
+            (200, [{"host": "host-1"}]),
+            too_many,
+        )
+    )
+    with pytest.raises(FetchError):
+        run(list_ids(session, vm_url, {}, "vm"))
+    assert session.client_session.requests[-1] == (
+        "GET",
+        vm_url + "?datacenters=dc-1&hosts=host-1",
+    )
+
+
+def test_run_for_each():
+    async def func(params, session):
+        if params["vm"] == "vm-2":
+            return {"value": "Not enough memory", "failed": True, "msg": "Failed"}
+        if params["vm"] == "vm-3":
+            raise aiohttp.ServerDisconnectedError()
+        return {"value": {}, "changed": params["vm"] == "vm-1"}
+
+    session = build_session(None)
+    ids = ["vm-1", "vm-2", "vm-1", "vm-3", "vm-4"]
+    result = run(run_for_each(session, func, {"state": "on"}, "vm", ids))
+    assert result["changed"] and result["failed"]
+    assert [(i["vm"], i["changed"], i["failed"]) for i in result["value"]] == [
+        ("vm-1", True, False),
+        ("vm-2", False, True),
+        ("vm-3", False, True),
+        ("vm-4", False, False),
+    ]
+    assert result["value"][1]["msg"] == "Failed"
+    assert result["value"][2]["msg"] == "Server disconnected"
+
+
+def test_expired_session_is_renewed_once():
+    async def _test():
+        logins = []
+
+        def handler(method, url, **kwargs):
+            if url.endswith("/api/session"):
+                logins.append(url)
+                return 201, "new-session-id"
+            if kwargs["headers"]["vmware-api-session-id"] != "new-session-id":
+                return 401, {"error_type": "UNAUTHENTICATED"}
+            return 200, {"url": url}
+
+        session = build_session(handler)
+        urls = [f"https://vcenter.test/api/vcenter/vm/vm-{i}" for i in range(5)]
+        responses = await asyncio.gather(*[session.request("GET", i) for i in urls])
+        assert [resp.status for resp in responses] == [200] * 5
+        assert len(logins) == 1
+        assert session.session_id == "new-session-id"
+        assert session.in_flight == 0
+
+    run(_test())
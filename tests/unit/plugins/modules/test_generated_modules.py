@@ -0,0 +1,74 @@
+"""The generated modules have been changed in this repository (see dev.md).
+
+These tests fail if `tox -e refresh_modules` drops one of these changes
+because it has not been ported to the templates of the generator yet.
+"""
+import glob
+import os
+
+import pytest
+
+
+MODULES_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "..", "plugins", "modules"
+)
+# The modules that wait for the vCenter task they start (wait option)
+WAIT_FOR_TASK = {
+    "appliance_infraprofile_configs": ["_import_profile", "_validate"],
+    "appliance_networking": ["_change"],
+    "vcenter_vm": ["_clone", "_relocate"],
+}
+
+
+def read_generated_modules():
+    modules = []
+    for path in sorted(glob.glob(os.path.join(MODULES_DIR, "*.py"))):
+        with open(path) as fd:
+            source = fd.read()
+        if "# template: " in source:
+            modules.append((os.path.basename(path)[:-3], source))
+    return modules
+
+
+GENERATED_MODULES = read_generated_modules()
+
+
+def get_function(source, name):
+    """Return the source of the function name, up to the next function."""
+    start = source.index("\nasync def {0}(".format(name))
+    end = source.find("\ndef ", start + 1)
+    next_async = source.find("\nasync def ", start + 1)
+    ends = [i for i in (end, next_async) if i != -1]
+    return source[start : min(ends)] if ends else source[start:]
+
+
+def test_the_generated_modules_are_found():
+    assert len(GENERATED_MODULES) > 100
+
+
+@pytest.mark.parametrize(
+    "name,source", GENERATED_MODULES, ids=[i[0] for i in GENERATED_MODULES]
+)
+def test_generated_module_hooks(name, source):
+    # The connection options are passed to open_session()
+    assert 'task_timeout=module.params["vcenter_rest_task_timeout"]' in source
+    assert 'fallback=(env_fallback, ["VMWARE_REST_TASK_TIMEOUT"])' in source
+    if "# template: info_" in source:
+        assert "await wait_until(\n        lambda: entry_point(module, session)," in (
+            source
+        )
+        assert 'argument_spec["wait_for_timeout"]' in source
+    if "list context" in source:
+        assert "_json = await build_device_list(" in source
+        assert 'details=module.params["details"]' in source
+        assert 'fields=module.params["fields"]' in source
+    if "\nasync def _update(" in source:
+        assert "get_update_payload(" in get_function(source, "_update")
+    if "\nasync def _set(" in source:
+        assert "is_already_set(" in get_function(source, "_set")
+    for func in WAIT_FOR_TASK.get(name, []):
+        assert "await wait_for_task(" in get_function(source, func)
+    if name in WAIT_FOR_TASK:
+        assert 'argument_spec["wait"]' in source
+    if name == "vcenter_vm_power":
+        assert "await run_for_each(" in get_function(source, "_bulk")
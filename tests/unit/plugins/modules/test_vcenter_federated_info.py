@@ -0,0 +1,48 @@
+from ansible_collections.vmware.vmware_rest.plugins.modules.vcenter_federated_info import (
+    merge_answers,
+)
+
+
+def build_answer(vcenter, items=None, msg=None):
+    summary = {"vcenter": vcenter, "failed": bool(msg), "count": len(items or [])}
+    if msg:
+        summary["msg"] = msg
+    return summary, [dict(i, vcenter=vcenter) for i in items or []]
+
+
+def test_merge_answers():
+    result = merge_answers(
+        [
+            build_answer("vcenter-eu", [{"vm": "vm-1"}]),
+            build_answer("vcenter-us", [{"vm": "vm-1"}, {"vm": "vm-2"}]),
+        ]
+    )
+    assert not result["failed"]
+    assert result["value"] == [
+        {"vm": "vm-1", "vcenter": "vcenter-eu"},
+        {"vm": "vm-1", "vcenter": "vcenter-us"},
+        {"vm": "vm-2", "vcenter": "vcenter-us"},
+    ]
+
+
+def test_merge_answers_with_a_failure():
+    result = merge_answers(
+        [
+            build_answer("vcenter-eu", [{"vm": "vm-1"}]),
+            build_answer("vcenter-us", msg="Timeout while connecting to vcenter-us"),
+        ]
+    )
+    assert not result["failed"]
+    assert [i["failed"] for i in result["vcenters"]] == [False, True]
+    assert result["value"] == [{"vm": "vm-1", "vcenter": "vcenter-eu"}]
+
+
+def test_merge_answers_all_failed():
+    result = merge_answers(
+        [
+            build_answer("vcenter-eu", msg="Timeout while connecting to vcenter-eu"),
+            build_answer("vcenter-us", msg="Timeout while connecting to vcenter-us"),
+        ]
+    )
+    assert result["failed"]
+    assert result["msg"] == "Cannot query vcenter-eu, vcenter-us"
@@ -0,0 +1,170 @@
+import asyncio
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from ansible_collections.vmware.vmware_rest.plugins.modules.vcenter_vm_batch import (
+    _instant_clone,
+    _present,
+    _relocate,
+    find_existing,
+    is_in_place,
+    locate_vms,
+)
+from ansible_collections.vmware.vmware_rest.tests.unit.utils import (
+    build_session,
+    run,
+)
+
+
+LOCATION = {
+    "host": "host-1",
+    "datastores": ["datastore-1"],
+    "placements": {("cluster", "domain-c8"), ("folder", "group-v4")},
+}
+
+
+@pytest.mark.parametrize(
+    "placement,expected",
+    [
+        ({"host": "host-1"}, True),
+        ({"host": "host-1", "datastore": "datastore-1"}, True),
+        ({"datastore": "datastore-1", "cluster": "domain-c8"}, True),
+        ({"folder": "group-v4"}, True),
+        ({"host": "host-2"}, False),
+        ({"datastore": "datastore-2"}, False),
+        ({"host": "host-1", "cluster": "domain-c9"}, False),
+        ({"datastore": "datastore-1", "resource_pool": "resgroup-9"}, False),
+        ({"host": "host-1", "folder": "group-v5"}, False),
+        ({}, False),
+    ],
+)
+def test_is_in_place(placement, expected):
+    assert is_in_place(LOCATION, placement) is expected
+
+
+class FakeVCenter:
+    """vm-1 is on host-1, datastore-1 and in domain-c8, the others nowhere."""
+
+    def __init__(self):
+        self.moving = 0
+        self.max_moving = 0
+
+    async def __call__(self, method, url, **kwargs):
+        url = urlparse(url)
+        query = parse_qs(url.query)
+        if method == "POST":
+            self.moving += 1
+            self.max_moving = max(self.max_moving, self.moving)
+            await asyncio.sleep(0.01)
+            self.moving -= 1
+            return 400, {"error_type": "INVALID_ARGUMENT"}
+        if url.path == "/api/vcenter/host":
+            return 200, [{"host": "host-1"}]
+        if url.path == "/api/vcenter/datastore":
+            return 200, [{"datastore": "datastore-1", "name": "ds1"}]
+        if url.path == "/api/vcenter/vm" and query.get("hosts") == ["host-1"]:
+            return 200, [{"vm": "vm-1"}]
+        if url.path == "/api/vcenter/vm" and query.get("clusters") == ["domain-c8"]:
+            return 200, [{"vm": i} for i in query["vms"] if i == "vm-1"]
+        if url.path == "/api/vcenter/vm":
+            return 200, []
+        if url.path == "/api/vcenter/vm/vm-1":
+            disk = {"backing": {"type": "VMDK_FILE", "vmdk_file": "[ds1] vm-1.vmdk"}}
+            return 200, {"disks": {"2000": disk}}
+        return 200, {"disks": {}}
+
+
+def build_params(**kwargs):
+    params = {
+        "vcenter_hostname": "vcenter.test",
+        "vms": None,
+        "placement": None,
+        "max_moves_per_host": 1,
+        "max_moves_per_datastore": 4,
+    }
+    params.update(kwargs)
+    return params
+
+
+def test_locate_vms():
+    session = build_session(FakeVCenter())
+    targets = {("cluster", "domain-c8"): ["vm-1", "vm-2"]}
+    locations = run(locate_vms(build_params(), session, ["vm-1", "vm-2"], targets))
+    assert locations == {
+        "vm-1": {
+            "host": "host-1",
+            "datastores": ["datastore-1"],
+            "placements": {("cluster", "domain-c8")},
+        },
+        "vm-2": {"host": None, "datastores": [], "placements": set()},
+    }
+
+
+def test_relocate_compares_the_whole_placement():
+    session = build_session(FakeVCenter())
+    params = build_params(
+        vms=[{"vm": "vm-1"}, {"vm": "vm-2"}],
+        placement={"datastore": "datastore-1", "cluster": "domain-c8"},
+    )
+    result = run(_relocate(params, session, check_mode=True))
+    assert [i["changed"] for i in result["value"]] == [False, True]
+    params["placement"]["cluster"] = "domain-c9"
+    result = run(_relocate(params, session, check_mode=True))
+    assert [i["changed"] for i in result["value"]] == [True, True]
+
+
+def test_relocate_limits_the_unlocated_vms():
+    vcenter = FakeVCenter()
+    session = build_session(vcenter)
+    params = build_params(
+        vms=[{"vm": "vm-2"}, {"vm": "vm-3"}, {"vm": "vm-4"}],
+        placement={"host": "host-1"},
+    )
+    result = run(_relocate(params, session))
+    assert result["stats"]["failed"] == 3
+    assert vcenter.max_moving == 1
+
+
+def test_find_existing_looks_in_the_folder():
+    def handler(method, url, **kwargs):
+        query = parse_qs(urlparse(url).query)
+        if query["folders"] == ["group-v4"]:
+            return 200, [{"vm": "vm-1", "name": "web1"}]
+        return 200, []
+
+    session = build_session(handler)
+    specs = [
+        {"name": "web1", "placement": {"folder": "group-v4"}},
+        {"name": "web1", "placement": {"folder": "group-v5"}},
+        {"name": "web2", "placement": {"folder": "group-v4"}},
+    ]
+    existing = run(find_existing(build_params(), session, specs))
+    assert existing == {("group-v4", "web1"): "vm-1"}
+    assert sorted(i[1] for i in session.client_session.requests) == [
+        "https://vcenter.test/api/vcenter/vm?names=web1&folders=group-v5",
+        "https://vcenter.test/api/vcenter/vm?names=web1&names=web2&folders=group-v4",
+    ]
+
+
+def test_present_needs_a_folder():
+    session = build_session(None)
+    params = build_params(vms=[{"name": "web1", "placement": {"cluster": "domain-c8"}}])
+    result = run(_present(params, session))
+    assert result["failed"]
+    assert "placement.folder" in result["msg"]
+    assert not session.client_session.requests
+
+
+def test_instant_clone_needs_a_folder():
+    session = build_session(None)
+    params = build_params(
+        source="vm-1",
+        name_pattern="desktop-{index}",
+        count=2,
+        start_index=1,
+        clone_spec=None,
+    )
+    result = run(_instant_clone(params, session))
+    assert result["failed"]
+    assert not session.client_session.requests
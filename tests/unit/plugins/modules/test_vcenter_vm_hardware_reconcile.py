@@ -0,0 +1,112 @@
+import pytest
+
+from ansible_collections.vmware.vmware_rest.plugins.modules.vcenter_vm_hardware_reconcile import (
+    UnsupportedChange,
+    get_plan,
+    match_devices,
+)
+
+
+def build_params(**kwargs):
+    params = {
+        "boot": None,
+        "cdroms": None,
+        "cpu": None,
+        "disks": None,
+        "memory": None,
+        "nics": None,
+    }
+    params.update(kwargs)
+    return params
+
+
+VM = {
+    "cpu": {"count": 1, "cores_per_socket": 1, "hot_add_enabled": False},
+    "memory": {"size_MiB": 1024, "hot_add_enabled": False},
+    "disks": {
+        "2000": {
+            "label": "Hard disk 1",
+            "type": "SCSI",
+            "scsi": {"bus": 0, "unit": 0},
+            "backing": {"type": "VMDK_FILE", "vmdk_file": "[ds] vm/vm.vmdk"},
+        }
+    },
+    "nics": {
+        "4000": {
+            "label": "Network adapter 1",
+            "type": "VMXNET3",
+            "mac_address": "00:50:56:aa:bb:cc",
+            "start_connected": False,
+            "backing": {"type": "STANDARD_PORTGROUP", "network": "network-1"},
+        }
+    },
+}
+
+
+def test_get_plan_partial_address_creates_the_disk():
+    new_disk = {"type": "SCSI", "scsi": {"bus": 0}, "new_vmdk": {"capacity": 1024}}
+    plan = get_plan(build_params(disks=[new_disk]), VM)
+    assert plan == [
+        {
+            "device": "disks",
+            "operation": "create",
+            "spec": {
+                "type": "SCSI",
+                "scsi": {"bus": 0},
+                "new_vmdk": {"capacity": 1024},
+            },
+        }
+    ]
+
+
+def test_get_plan_unlabeled_disk_is_created():
+    new_disk = {"type": "SCSI", "new_vmdk": {"capacity": 1024}}
+    plan = get_plan(build_params(disks=[new_disk]), VM)
+    assert [i["operation"] for i in plan] == ["create"]
+
+
+def test_get_plan_full_address_matches():
+    disk = {"scsi": {"bus": 0, "unit": 0}, "type": "SCSI"}
+    assert get_plan(build_params(disks=[disk]), VM) == []
+
+
+def test_get_plan_update():
+    nic = {"mac_address": "00:50:56:AA:BB:CC", "start_connected": "true"}
+    plan = get_plan(build_params(cpu={"count": 2}, nics=[nic]), VM)
+    assert plan == [
+        {"device": "cpu", "operation": "update", "spec": {"count": 2}},
+        {
+            "device": "nics",
+            "id": "4000",
+            "operation": "update",
+            "spec": {"start_connected": "true"},
+        },
+    ]
+
+
+def test_get_plan_already_converged():
+    params = build_params(
+        cpu={"count": 1},
+        memory={"size_MiB": "1024"},
+        disks=[{"label": "Hard disk 1", "type": "SCSI"}],
+    )
+    assert get_plan(params, VM) == []
+
+
+def test_get_plan_unsupported_change():
+    with pytest.raises(UnsupportedChange, match="type"):
+        get_plan(build_params(disks=[{"label": "Hard disk 1", "type": "SATA"}]), VM)
+
+
+def test_match_devices_label_first():
+    current = {
+        "2000": {"label": "Hard disk 1", "scsi": {"bus": 0, "unit": 0}},
+        "2001": {"label": "Hard disk 2", "scsi": {"bus": 0, "unit": 1}},
+    }
+    expected = [
+        {"label": "Hard disk 2", "scsi": {"bus": 0, "unit": 0}},
+        {"scsi": {"bus": 0, "unit": 0}},
+        {"scsi": {"bus": 0, "unit": 2}},
+    ]
+    pairs = match_devices(current, expected, ["scsi"])
+    assert [i[0] for i in pairs] == ["2001", "2000", None]
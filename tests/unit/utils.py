@@ -0,0 +1,94 @@
+"""Fake aiohttp objects to run the vmware_rest helpers without a vCenter."""
+import asyncio
+import json
+
+import aiohttp
+
+from ansible_collections.vmware.vmware_rest.plugins.module_utils.vmware_rest import (
+    PooledSession,
+    _RequestContextManager,
+)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FakeResponse:
+    def __init__(self, status=200, body=None, headers=None, method="GET", url=""):
+        self.status = status
+        self.method = method
+        self.url = url
+        self.headers = {"Content-Type": "application/json"}
+        self.headers.update(headers or {})
+        self._body = json.dumps(body).encode() if body is not None else b""
+        self.released = False
+
+    async def read(self):
+        return self._body
+
+    async def text(self, encoding="utf-8"):
+        return self._body.decode(encoding)
+
+    async def json(self, **kwargs):
+        return json.loads(self._body) if self._body else None
+
+    def release(self):
+        self.released = True
+
+
+class FakeClientSession:
+    """Answer the requests with handler(method, url, **kwargs).
+
+    handler returns a FakeResponse, a (status, body) tuple, or raises. It
+    can be a coroutine function. The requests are recorded in requests.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.closed = False
+
+    async def _request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        resp = self.handler(method, url, **kwargs)
+        if asyncio.iscoroutine(resp):
+            resp = await resp
+        if isinstance(resp, tuple):
+            resp = FakeResponse(*resp)
+        resp.method = method
+        resp.url = url
+        return resp
+
+    def request(self, method, url, **kwargs):
+        return _RequestContextManager(self._request(method, url, **kwargs))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    async def close(self):
+        self.closed = True
+
+
+def build_session(handler, vcenter_hostname="vcenter.test", **kwargs):
+    """Return a logged in PooledSession that sends its requests to handler."""
+    session = PooledSession(
+        aiohttp,
+        FakeClientSession(handler),
+        vcenter_hostname,
+        aiohttp.BasicAuth("user", "password"),
+        kwargs.pop("concurrency", 4),
+        **kwargs
+    )
+    session.session_id = "session-id"
+    return session